@@ -0,0 +1,266 @@
+"""
+Micro-benchmarks of every agent in base_agents.py against an offline backend.
+
+Most cases use an in-process stand-in for the OpenAI client, so the timings are
+the agents' own overhead (prompt building, embedding handling, similarity
+search, control flow). The "respond" group also goes through HTTP to the local
+stub server to show the client and connection cost. No API access is needed.
+
+Run from the phase_1 directory:
+
+    python -m benchmarks.agents --output agents.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from workflow_agents.base_agents import (
+    ActionPlanningAgent,
+    AugmentedPromptAgent,
+    DirectPromptAgent,
+    EvaluationAgent,
+    KnowledgeAugmentedPromptAgent,
+    RAGKnowledgePromptAgent,
+    RoutingAgent,
+    RoutingCache,
+    cosine_similarity,
+)
+from workflow_agents.stub_server import StubServer, fake_embedding
+
+PROMPT = "What are the main features of the email router and who are its users?"
+# Agents never use these: every client is injected.
+BASE_URL = "http://offline.invalid/v1"
+API_KEY = "offline"
+
+
+class OfflineClient:
+    """
+    In-process stand-in for the OpenAI client. Embeddings come from the stub
+    server's deterministic fake_embedding with the given number of dimensions,
+    or with those a request asks for; chat completions return a fixed answer,
+    and judge requests ("Evaluate ...") return judge_reply. latency (seconds) is
+    slept on every call.
+    """
+    def __init__(self, dimensions=1536, judge_reply="No", latency=0.0):
+        self.dimensions = dimensions
+        self.judge_reply = judge_reply
+        self.latency = latency
+        self.calls = {"chat": 0, "embeddings": 0}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embeddings)
+
+    def _count(self, kind):
+        with self._lock:
+            self.calls[kind] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _chat(self, model, messages, **kwargs):
+        self._count("chat")
+        content = self.judge_reply if messages[-1]["content"].startswith("Evaluate") else "A fixed offline answer. " * 8
+        message = SimpleNamespace(content=content, role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, index=0)])
+
+    def _embeddings(self, input, model, dimensions=None, **kwargs):
+        self._count("embeddings")
+        dimensions = dimensions or self.dimensions
+        data = [SimpleNamespace(index=i, embedding=fake_embedding(text, dimensions)) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data)
+
+
+def make_documents(n, words_per_document=60, vocabulary=5000, seed=0):
+    """Synthetic documents of random words from a fixed vocabulary."""
+    rng = np.random.default_rng(seed)
+    words = rng.integers(0, vocabulary, size=(n, words_per_document))
+    return [" ".join(f"w{word}" for word in row) for row in words]
+
+
+def time_call(fn, repeat):
+    """Calls fn repeat times and returns the median and 95th percentile in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = 1000 * np.array(times)
+    return {"median_ms": round(float(np.median(times)), 6), "p95_ms": round(float(np.percentile(times, 95)), 6)}
+
+
+def quiet(fn, *args, **kwargs):
+    """Calls fn with its prints suppressed (the RAG agent reports its initialization)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def bench_prompt_construction(repeat, knowledge_chars):
+    """Cost of building the chat messages of each agent, without any request."""
+    client = OfflineClient()
+    knowledge = ("The Email Router classifies and routes incoming email. " * knowledge_chars)[:knowledge_chars]
+    worker = KnowledgeAugmentedPromptAgent(BASE_URL, API_KEY, "a product manager", knowledge, client=client, async_client=client)
+    cases = {
+        "DirectPromptAgent": DirectPromptAgent(BASE_URL, API_KEY, client=client, async_client=client)._messages,
+        "AugmentedPromptAgent": AugmentedPromptAgent(BASE_URL, "a product manager", API_KEY, client=client,
+                                                     async_client=client)._messages,
+        "KnowledgeAugmentedPromptAgent": worker._messages,
+        "RAGKnowledgePromptAgent": lambda prompt: RAGKnowledgePromptAgent._messages(prompt, knowledge),
+        "EvaluationAgent": EvaluationAgent(BASE_URL, API_KEY, "an evaluator", "criteria", worker, client=client,
+                                           async_client=client)._evaluation_messages,
+        "ActionPlanningAgent": ActionPlanningAgent(BASE_URL, API_KEY, knowledge, client=client,
+                                                   async_client=client)._messages,
+    }
+    return [
+        {"group": "prompt_construction", "agent": name, "knowledge_chars": knowledge_chars,
+         **time_call(lambda: build(PROMPT), repeat)}
+        for name, build in cases.items()
+    ]
+
+
+def bench_respond(repeat, latency):
+    """Full respond() calls of the prompt agents, in-process and over HTTP to the stub server."""
+    results = []
+    with StubServer(latency=latency) as server:
+        backends = {"offline": OfflineClient(latency=latency), "stub_http": None}
+        for backend, client in backends.items():
+            clients = {"client": client, "async_client": client} if client is not None else {}
+            url = server.url
+            agents = {
+                "DirectPromptAgent": DirectPromptAgent(url, API_KEY, **clients),
+                "AugmentedPromptAgent": AugmentedPromptAgent(url, "a product manager", API_KEY, **clients),
+                "KnowledgeAugmentedPromptAgent": KnowledgeAugmentedPromptAgent(url, API_KEY, "a product manager",
+                                                                               "Some knowledge.", **clients),
+            }
+            for name, agent in agents.items():
+                agent.respond(PROMPT)  # warm up the connection
+                results.append({"group": "respond", "agent": name, "backend": backend, "latency": latency,
+                                **time_call(lambda: agent.respond(PROMPT), repeat)})
+    return results
+
+
+def bench_cosine_similarity(repeat, dims):
+    """cosine_similarity() of two vectors vs. embedding dimension."""
+    rng = np.random.default_rng(0)
+    results = []
+    for dim in dims:
+        v1, v2 = rng.normal(size=(2, dim))
+        results.append({"group": "cosine_similarity", "dim": dim,
+                        **time_call(lambda: cosine_similarity(v1, v2), repeat)})
+    return results
+
+
+def bench_retrieval(repeat, kb_sizes, dims):
+    """RAG ingestion and retrieve() cost vs. knowledge base size and embedding dimension."""
+    results = []
+    for dim in dims:
+        for size in kb_sizes:
+            client = OfflineClient(dimensions=dim)
+            documents = make_documents(size)
+            start = time.perf_counter()
+            agent = quiet(RAGKnowledgePromptAgent, BASE_URL, API_KEY, documents, client=client, async_client=client)
+            build_seconds = time.perf_counter() - start
+            query = documents[size // 2]
+            results.append({"group": "retrieval", "kb_size": size, "dim": dim,
+                            "build_seconds": round(build_seconds, 4),
+                            **time_call(lambda: agent.retrieve(query, k=3), repeat)})
+    return results
+
+
+def bench_routing(repeat, agent_counts):
+    """
+    Routing cost vs. number of agents: description indexing, selection (also
+    served from a RoutingCache) and a full route().
+    """
+    results = []
+    documents = make_documents(max(agent_counts), words_per_document=20, seed=1)
+    for count in agent_counts:
+        client = OfflineClient()
+        router = RoutingAgent(BASE_URL, API_KEY, client=client, async_client=client)
+        agents = [{"name": f"agent {i}", "description": documents[i], "func": lambda prompt: prompt}
+                  for i in range(count)]
+        start = time.perf_counter()
+        router.agents = agents
+        index_ms = 1000 * (time.perf_counter() - start)
+        prompt = documents[count // 2]
+        results.append({"group": "routing", "n_agents": count, "operation": "index", "median_ms": round(index_ms, 6),
+                        "p95_ms": round(index_ms, 6)})
+        results.append({"group": "routing", "n_agents": count, "operation": "select_agent",
+                        **time_call(lambda: router.select_agent(prompt), repeat)})
+        results.append({"group": "routing", "n_agents": count, "operation": "route",
+                        **time_call(lambda: router.route(prompt), repeat)})
+        router.routing_cache = RoutingCache()
+        router.select_agent(prompt)
+        results.append({"group": "routing", "n_agents": count, "operation": "select_agent_cached",
+                        **time_call(lambda: router.select_agent(prompt), repeat)})
+        results.append({"group": "routing", "n_agents": count, "operation": "select_agent_near_duplicate",
+                        **time_call(lambda: router.select_agent(prompt.upper() + "."), repeat)})
+    return results
+
+
+def bench_evaluation(repeat, max_interactions, latency):
+    """
+    EvaluationAgent.evaluate() cost vs. max_interactions when the judge never
+    accepts, in the two-call and the structured single-call mode.
+    """
+    results = []
+    for structured in (False, True):
+        for interactions in max_interactions:
+            client = OfflineClient(judge_reply="No", latency=latency)
+            worker = KnowledgeAugmentedPromptAgent(BASE_URL, API_KEY, "a product manager", "Some knowledge.",
+                                                   client=client, async_client=client)
+            evaluator = EvaluationAgent(BASE_URL, API_KEY, "an evaluator", "The answer must say yes.", worker,
+                                        max_interactions=interactions, structured=structured,
+                                        client=client, async_client=client)
+            timing = time_call(lambda: evaluator.evaluate(PROMPT), repeat)
+            results.append({"group": "evaluation", "mode": "structured" if structured else "two_call",
+                            "max_interactions": interactions, "latency": latency,
+                            "chat_calls_per_evaluation": client.calls["chat"] // repeat, **timing})
+    return results
+
+
+def main():
+    """
+    Runs every benchmark group and prints one line per case.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50, help="calls per measured case")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 1536, 3072], help="embedding dimensions")
+    parser.add_argument("--kb-sizes", type=int, nargs="+", default=[100, 1000, 10000], help="RAG knowledge base sizes")
+    parser.add_argument("--n-agents", type=int, nargs="+", default=[3, 30, 300], help="routing agent counts")
+    parser.add_argument("--max-interactions", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="evaluation loop limits")
+    parser.add_argument("--knowledge-chars", type=int, default=20_000, help="knowledge size for prompt building")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per API call")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    results += bench_prompt_construction(args.repeat * 20, args.knowledge_chars)
+    results += bench_respond(args.repeat, args.latency)
+    results += bench_cosine_similarity(args.repeat * 20, args.dims)
+    results += bench_retrieval(args.repeat, args.kb_sizes, args.dims)
+    results += bench_routing(args.repeat, args.n_agents)
+    results += bench_evaluation(max(1, args.repeat // 10), args.max_interactions, args.latency)
+
+    report = {
+        "benchmark": "agents",
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    labels = ("agent", "backend", "dim", "kb_size", "n_agents", "operation", "mode", "max_interactions")
+    print(f"{'group':<20}{'case':<50}{'median ms':>12}{'p95 ms':>12}")
+    for row in results:
+        case = " ".join(f"{label}={row[label]}" for label in labels if label in row)
+        print(f"{row['group']:<20}{case:<50}{row['median_ms']:>12.4f}{row['p95_ms']:>12.4f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
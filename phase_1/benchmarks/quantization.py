@@ -0,0 +1,172 @@
+"""
+Memory and retrieval accuracy of the embedding storage settings: float32,
+bfloat16 and int8 vectors, at full length and shortened with the embeddings
+`dimensions` parameter.
+
+Two groups are measured:
+  - rag_agent: RAGKnowledgePromptAgent on synthetic documents with the offline
+    client, so `dimensions` goes through the same request path as with the
+    API. Queries are a few words sampled from a document; top1 is how often
+    that document is retrieved first.
+  - index: FlatIndex on dense synthetic embeddings (see benchmarks.vector_index),
+    closer to real model output than the sparse offline vectors, shortened by
+    keeping their leading coordinates. recall_full is the recall of the top k
+    found with float32 vectors at full length.
+Both report recall, the share of the top k found with float32 vectors of the
+same length, and the memory per vector next to that of the embedding kept as
+a Python list of floats.
+
+Run from the phase_1 directory:
+
+    python -m benchmarks.quantization --documents 10000 --output quantization.json
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.agents import API_KEY, BASE_URL, OfflineClient, make_documents, quiet
+from benchmarks.vector_index import make_corpus, recall_at_k
+from workflow_agents.base_agents import RAGKnowledgePromptAgent, normalize_rows
+from workflow_agents.vector_index import PRECISIONS, FlatIndex
+
+
+def list_bytes(vector):
+    """Memory of one embedding kept as a Python list of floats."""
+    values = vector.tolist()
+    return sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+
+
+def make_queries(documents, n, words, seed=0):
+    """Queries of a few words sampled from random documents, with the index of their document."""
+    rng = np.random.default_rng(seed)
+    sources = rng.choice(len(documents), n, replace=False)
+    queries = []
+    for source in sources:
+        document_words = documents[source].split()
+        queries.append(" ".join(rng.choice(document_words, words, replace=False)))
+    return queries, sources
+
+
+def search_ids(search, queries, k):
+    """Runs the queries one at a time; returns the found ids and the mean milliseconds per query."""
+    start = time.perf_counter()
+    found = [search(query, k) for query in queries]
+    return found, 1000 * (time.perf_counter() - start) / len(queries)
+
+
+def bench_rag_agent(n_documents, n_queries, query_words, k, model_dimensions, dimensions):
+    """The RAG agent at every precision and embedding length."""
+    documents = make_documents(n_documents)
+    positions = {document: i for i, document in enumerate(documents)}
+    queries, sources = make_queries(documents, n_queries, query_words)
+    results = []
+    for dims in [None] + dimensions:
+        client = OfflineClient(dimensions=model_dimensions)
+        baseline = None
+        for precision in PRECISIONS:
+            start = time.perf_counter()
+            agent = quiet(RAGKnowledgePromptAgent, BASE_URL, API_KEY, documents, precision=precision,
+                          dimensions=dims, client=client, async_client=client)
+            build_seconds = time.perf_counter() - start
+            # Queries are embedded up front so only the search is timed.
+            query_embeddings = agent.get_embeddings(queries)
+            found, query_ms = search_ids(
+                lambda embedding, k: [positions[chunk] for chunk, _ in agent._search(embedding, k)],
+                query_embeddings, k)
+            found = np.array(found)
+            if baseline is None:
+                baseline = found
+            index = agent.index
+            results.append({
+                "group": "rag_agent",
+                "precision": precision,
+                "dimensions": dims or model_dimensions,
+                "top1": round(float(np.mean(found[:, 0] == sources)), 4),
+                "recall": round(recall_at_k(found, baseline), 4),
+                "bytes_per_vector": round(index.nbytes() / len(index), 1),
+                "list_bytes_per_vector": list_bytes(query_embeddings[0]),
+                "index_bytes": int(index.nbytes()),
+                "build_seconds": round(build_seconds, 4),
+                "query_ms": round(query_ms, 4),
+            })
+    return results
+
+
+def bench_index(n, n_queries, k, dim, dimensions):
+    """FlatIndex at every precision on dense vectors, at full length and truncated and renormalized."""
+    vectors, queries = make_corpus(n, dim, n_queries)
+    results = []
+    full = None
+    for dims in [dim] + dimensions:
+        # Like text-embedding-3's shortened vectors: the leading coordinates, renormalized.
+        stored = normalize_rows(vectors[:, :dims])
+        shortened_queries = normalize_rows(queries[:, :dims])
+        baseline = None
+        for precision in PRECISIONS:
+            index = FlatIndex(precision)
+            index.add(stored)
+            found, query_ms = search_ids(lambda query, k: index.search(query, k)[1], shortened_queries, k)
+            found = np.array(found)
+            if baseline is None:
+                baseline = found
+            if full is None:
+                full = found
+            results.append({
+                "group": "index",
+                "precision": precision,
+                "dimensions": dims,
+                "recall": round(recall_at_k(found, baseline), 4),
+                "recall_full": round(recall_at_k(found, full), 4),
+                "bytes_per_vector": round(index.nbytes() / len(index), 1),
+                "list_bytes_per_vector": list_bytes(stored[0]),
+                "index_bytes": int(index.nbytes()),
+                "query_ms": round(query_ms, 4),
+            })
+    return results
+
+
+def main():
+    """
+    Benchmarks every precision and embedding length and prints one line per setting.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5000, help="documents in the RAG knowledge base")
+    parser.add_argument("--n", type=int, default=50_000, help="vectors in the dense index")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--query-words", type=int, default=3, help="words of a document in each RAG query")
+    parser.add_argument("--k", type=int, default=10, help="results per query")
+    parser.add_argument("--model-dimensions", type=int, default=3072,
+                        help="full embedding length (text-embedding-3-large: 3072)")
+    parser.add_argument("--dim", type=int, default=1024, help="full length of the dense vectors")
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[1024, 256],
+                        help="shortened lengths to request")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = bench_rag_agent(args.documents, args.queries, args.query_words, args.k, args.model_dimensions,
+                              [d for d in args.dimensions if d < args.model_dimensions])
+    results += bench_index(args.n, args.queries, args.k, args.dim, [d for d in args.dimensions if d < args.dim])
+
+    report = {
+        "benchmark": "quantization",
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    print(f"{'group':<11}{'precision':<10}{'dims':>6}{'top1':>7}{'recall':>8}{'recall_full':>13}"
+          f"{'B/vector':>10}{'list B/vector':>15}{'query ms':>10}")
+    for row in results:
+        top1 = f"{row['top1']:.3f}" if "top1" in row else "-"
+        recall_full = f"{row['recall_full']:.3f}" if "recall_full" in row else "-"
+        print(f"{row['group']:<11}{row['precision']:<10}{row['dimensions']:>6}{top1:>7}{row['recall']:>8.3f}"
+              f"{recall_full:>13}{row['bytes_per_vector']:>10.0f}{row['list_bytes_per_vector']:>15}"
+              f"{row['query_ms']:>10.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
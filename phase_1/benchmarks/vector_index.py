@@ -0,0 +1,109 @@
+"""
+Recall and latency of the approximate vector indexes against the exact FlatIndex.
+
+Run from the phase_1 directory:
+
+    python -m benchmarks.vector_index --n 100000 --dim 256 --output vector_index.json
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from workflow_agents.vector_index import FlatIndex, IVFIndex
+
+
+def make_corpus(n, dim, n_queries, n_topics=200, noise=0.35, seed=0):
+    """
+    Synthetic unit-length embeddings clustered around random topics, plus
+    queries drawn from the same topics, to mimic a real knowledge base.
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(0, n_topics, n)] + noise * rng.normal(size=(n, dim)).astype(np.float32)
+    queries = topics[rng.integers(0, n_topics, n_queries)] + noise * rng.normal(size=(n_queries, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+
+def recall_at_k(found_ids, true_ids):
+    """Fraction of the exact top-k neighbours that the approximate search returned."""
+    k = true_ids.shape[1]
+    return float(np.mean([len(set(found) & set(true)) / k for found, true in zip(found_ids, true_ids)]))
+
+
+def measure(index, vectors, queries, k):
+    """Builds the index, runs every query once and returns timings with the results."""
+    start = time.perf_counter()
+    index.add(vectors)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    found_ids = np.stack([index.search(query, k)[1] for query in queries])
+    query_seconds = time.perf_counter() - start
+    return found_ids, {
+        "build_seconds": round(build_seconds, 4),
+        "query_ms": round(1000 * query_seconds / len(queries), 4),
+        "index_bytes": int(index.nbytes()),
+    }
+
+
+def main():
+    """
+    Benchmarks the flat index and a grid of IVF / IVF-PQ settings.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=50_000, help="number of indexed vectors")
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension")
+    parser.add_argument("--queries", type=int, default=200, help="number of queries")
+    parser.add_argument("--k", type=int, default=10, help="neighbours per query")
+    parser.add_argument("--n-lists", type=int, default=256, help="IVF clusters")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 16, 64], help="IVF clusters scanned per query")
+    parser.add_argument("--pq-subvectors", type=int, nargs="*", default=[32], help="PQ code sizes to try")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    vectors, queries = make_corpus(args.n, args.dim, args.queries)
+    results = []
+
+    flat = FlatIndex()
+    true_ids, stats = measure(flat, vectors, queries, args.k)
+    results.append({"index": "flat", "recall": 1.0, **stats})
+
+    for pq_subvectors in [None] + args.pq_subvectors:
+        index = IVFIndex(n_lists=args.n_lists, pq_subvectors=pq_subvectors)
+        start = time.perf_counter()
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            start = time.perf_counter()
+            found_ids = np.stack([index.search(query, args.k, n_probe=n_probe)[1] for query in queries])
+            query_seconds = time.perf_counter() - start
+            results.append({
+                "index": "ivf" if pq_subvectors is None else f"ivf-pq{pq_subvectors}",
+                "n_lists": args.n_lists,
+                "n_probe": n_probe,
+                "recall": round(recall_at_k(found_ids, true_ids), 4),
+                "build_seconds": round(build_seconds, 4),
+                "query_ms": round(1000 * query_seconds / len(queries), 4),
+                "index_bytes": int(index.nbytes()),
+            })
+
+    report = {
+        "benchmark": "vector_index",
+        "params": {"n": args.n, "dim": args.dim, "queries": args.queries, "k": args.k},
+        "results": results,
+    }
+    print(f"{'index':<12}{'n_probe':>8}{f'recall@{args.k}':>11}{'query ms':>10}{'MB':>9}")
+    for row in results:
+        print(f"{row['index']:<12}{row.get('n_probe', '-'):>8}{row['recall']:>11.3f}"
+              f"{row['query_ms']:>10.3f}{row['index_bytes'] / 2**20:>9.1f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
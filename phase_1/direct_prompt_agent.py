@@ -7,7 +7,7 @@ def main():
     """
     Main function to test the DirectPromptAgent.
     """
-    base_url = "https://openai.vocareum.com/v1"
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
     api_key = "voc-00000000000000000000000000000000abcd.12345678"
 
     # if not openai_api_key:
@@ -3,12 +3,13 @@ import os
 # Import the class from base_agents.py
 # Make sure the RAGKnowledgePromptAgent class provided to you is in this file.
 from workflow_agents.base_agents import RAGKnowledgePromptAgent
+from workflow_agents.embedding_cache import EmbeddingCache
 
 def main():
     """
     Main function to test the RAGKnowledgePromptAgent.
     """
-    base_url = "https://openai.vocareum.com/v1"
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
     api_key = "voc-00000000000000000000000000000000abcd.12345678"
 
     # if not openai_api_key:
@@ -30,7 +31,9 @@ def main():
     rag_agent = RAGKnowledgePromptAgent(
         base_url = base_url, 
         openai_api_key= api_key,
-        knowledge_base=knowledge_base
+        knowledge_base=knowledge_base,
+        # Document embeddings are kept on disk and reused on the next run.
+        embedding_cache=EmbeddingCache()
     )
     
     # 3. Define the Prompt
@@ -2,12 +2,13 @@ import os
 # from dotenv import load_dotenv
 # Import the required classes from base_agents.py
 from workflow_agents.base_agents import RoutingAgent, KnowledgeAugmentedPromptAgent
+from workflow_agents.embedding_cache import EmbeddingCache
 
 def main():
     """
     Main function to test the RoutingAgent.
     """
-    base_url = "https://openai.vocareum.com/v1"
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
     api_key = "voc-00000000000000000000000000000000abcd.12345678"
 
     # if not openai_api_key:
@@ -39,8 +40,11 @@ def main():
     )
 
     # 2. Instantiate the Routing Agent
+    # Description and prompt embeddings are kept on disk, so re-running this
+    # script does not embed the same texts again.
     routing_agent = RoutingAgent(base_url = base_url,
-                                 openai_api_key= api_key)
+                                 openai_api_key= api_key,
+                                 embedding_cache=EmbeddingCache())
 
     # 3. Define Agent Functions/Lambdas and Descriptions
     # The 'description' is crucial as it's used for semantic routing.
@@ -0,0 +1,228 @@
+"""
+Email categorization and sentiment from embeddings, without chat calls.
+
+An EmailClassifier has two linear heads over the same embedding (the one
+computed for routing): one for the category ("password reset", "billing
+issue", ...) and one for the sentiment (Positive, Negative, Neutral). Heads are
+trained from labeled examples, either as per-label centroids or as a small
+softmax regression. Emails the heads are unsure about can be escalated to a
+prompt agent.
+
+Train a classifier from the phase_1 directory on labeled JSONL emails
+({"subject", "body", "category", "sentiment"} per line):
+
+    python -m workflow_agents.classifier labeled.jsonl --output classifier.npz
+"""
+import argparse
+import json
+import os
+import re
+
+import numpy as np
+
+from .base_agents import embed_texts, get_client, normalize_rows
+
+# Emails whose category or sentiment confidence is below this are escalated.
+CLASSIFIER_THRESHOLD = 0.6
+# Softmax temperature of the centroid heads: cosine similarities differ by a
+# few hundredths between related labels, so they are sharpened a lot.
+CENTROID_TEMPERATURE = 0.05
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _label_indices(labels):
+    names = sorted(set(labels))
+    lookup = {name: i for i, name in enumerate(names)}
+    return names, np.array([lookup[label] for label in labels])
+
+
+class LinearHead:
+    """
+    A classifier over unit-length embeddings: probabilities are
+    softmax(scale * embedding @ weights.T + bias). Build one with
+    fit_centroids() or fit_logistic().
+    """
+    def __init__(self, labels, weights, bias=None, scale=1.0):
+        self.labels = list(labels)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32) if bias is None else np.asarray(bias, np.float32)
+        self.scale = float(scale)
+
+    @classmethod
+    def fit_centroids(cls, embeddings, labels, temperature=CENTROID_TEMPERATURE):
+        """
+        Nearest-centroid head: each label's weights are the normalized mean of its
+        examples, so scores are cosine similarities to the centroids.
+        """
+        names, y = _label_indices(labels)
+        embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        centroids = np.stack([embeddings[y == i].mean(axis=0) for i in range(len(names))])
+        return cls(names, normalize_rows(centroids), scale=1.0 / temperature)
+
+    @classmethod
+    def fit_logistic(cls, embeddings, labels, epochs=300, learning_rate=0.5, l2=1e-4):
+        """
+        Softmax regression head trained by full-batch gradient descent with L2
+        regularization. The embeddings are scaled by sqrt(dimensions) while
+        training so the unit vectors' small coordinates still learn quickly.
+        """
+        names, y = _label_indices(labels)
+        embeddings = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        scale = np.sqrt(embeddings.shape[1])
+        x = embeddings * scale
+        targets = np.eye(len(names), dtype=np.float32)[y]
+        weights = np.zeros((len(names), x.shape[1]), dtype=np.float32)
+        bias = np.zeros(len(names), dtype=np.float32)
+        for _ in range(epochs):
+            error = (_softmax(x @ weights.T + bias) - targets) / len(x)
+            weights -= learning_rate * (error.T @ x + l2 * weights)
+            bias -= learning_rate * error.sum(axis=0)
+        return cls(names, weights, bias, scale=scale)
+
+    def predict_proba(self, embeddings):
+        """Label probabilities, one row per embedding and one column per label."""
+        return _softmax(self.scale * (normalize_rows(np.asarray(embeddings, dtype=np.float32)) @ self.weights.T)
+                        + self.bias)
+
+
+class EmailClassifier:
+    """
+    Category and sentiment of emails from their embeddings. Both heads are
+    scored in one matrix product. If an escalation_agent (any agent with
+    respond(prompt), e.g. an AugmentedPromptAgent) is given, emails whose
+    category or sentiment confidence is below threshold are classified by it
+    instead; they are marked 'escalated'. embedding_model and dimensions are
+    those of the embeddings the heads were trained on.
+    """
+    def __init__(self, category_head, sentiment_head, threshold=CLASSIFIER_THRESHOLD, escalation_agent=None,
+                 embedding_model="text-embedding-3-large", dimensions=None):
+        self.category_head = category_head
+        self.sentiment_head = sentiment_head
+        self.threshold = threshold
+        self.escalation_agent = escalation_agent
+        self.embedding_model = embedding_model
+        self.dimensions = dimensions
+        self._split = len(category_head.labels)
+        # Both heads as one matrix; the scales are folded into the weights.
+        self._weights = np.concatenate([category_head.weights * category_head.scale,
+                                        sentiment_head.weights * sentiment_head.scale]).T
+        self._bias = np.concatenate([category_head.bias, sentiment_head.bias])
+
+    @classmethod
+    def fit(cls, embeddings, categories, sentiments, head="centroid", **kwargs):
+        """
+        Trains both heads on labeled embeddings. head is "centroid" or
+        "logistic"; other keyword arguments go to the constructor.
+        """
+        fit = LinearHead.fit_centroids if head == "centroid" else LinearHead.fit_logistic
+        return cls(fit(embeddings, categories), fit(embeddings, sentiments), **kwargs)
+
+    def save(self, path):
+        """Writes both heads and the settings to a .npz file."""
+        # dimensions=None (the model's full length) is stored as 0.
+        arrays = {"threshold": self.threshold, "embedding_model": self.embedding_model,
+                  "dimensions": self.dimensions or 0}
+        for name, head in (("category", self.category_head), ("sentiment", self.sentiment_head)):
+            arrays.update({f"{name}_labels": np.array(head.labels), f"{name}_weights": head.weights,
+                           f"{name}_bias": head.bias, f"{name}_scale": head.scale})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path, escalation_agent=None):
+        """Reads a classifier written by save()."""
+        with np.load(path) as data:
+            heads = [
+                LinearHead(data[f"{name}_labels"].tolist(), data[f"{name}_weights"], data[f"{name}_bias"],
+                           data[f"{name}_scale"])
+                for name in ("category", "sentiment")
+            ]
+            dimensions = int(data["dimensions"]) if "dimensions" in data else 0
+            return cls(*heads, threshold=float(data["threshold"]), escalation_agent=escalation_agent,
+                       embedding_model=str(data["embedding_model"]), dimensions=dimensions or None)
+
+    def _escalate(self, text):
+        """Asks the escalation agent for the labels of one email; None for labels it did not give."""
+        categories = ", ".join(self.category_head.labels)
+        sentiments = ", ".join(self.sentiment_head.labels)
+        answer = self.escalation_agent.respond(
+            f"Classify this support email. Answer with the category on the first line (one of: {categories}) "
+            f"and the sentiment on the second line (one of: {sentiments}).\n\nEmail:\n{text}"
+        )
+        return tuple(_find_label(answer, head.labels) for head in (self.category_head, self.sentiment_head))
+
+    def classify(self, embeddings, texts=None):
+        """
+        Classifies a matrix of email embeddings. Returns one dict per email with
+        'category', 'sentiment', their confidences and 'escalated'. texts, the
+        embedded texts, are needed to escalate.
+        """
+        scores = normalize_rows(np.asarray(embeddings, dtype=np.float32)) @ self._weights + self._bias
+        category_proba = _softmax(scores[:, :self._split])
+        sentiment_proba = _softmax(scores[:, self._split:])
+        results = []
+        for i, (category, sentiment) in enumerate(zip(category_proba.argmax(axis=1), sentiment_proba.argmax(axis=1))):
+            result = {
+                "category": self.category_head.labels[category],
+                "category_confidence": round(float(category_proba[i, category]), 4),
+                "sentiment": self.sentiment_head.labels[sentiment],
+                "sentiment_confidence": round(float(sentiment_proba[i, sentiment]), 4),
+                "escalated": False,
+            }
+            unsure = min(result["category_confidence"], result["sentiment_confidence"]) < self.threshold
+            if unsure and self.escalation_agent is not None and texts is not None:
+                category, sentiment = self._escalate(texts[i])
+                result["category"] = category or result["category"]
+                result["sentiment"] = sentiment or result["sentiment"]
+                result["escalated"] = True
+            results.append(result)
+        return results
+
+
+def _find_label(answer, labels):
+    """The label named earliest in an answer, or None."""
+    positions = [(match.start(), label) for label in labels
+                 for match in [re.search(rf"\b{re.escape(label)}\b", answer, re.IGNORECASE)] if match]
+    return min(positions)[1] if positions else None
+
+
+def main():
+    # Imported here: email_routing imports this module.
+    from .email_routing import email_text
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("examples", help="JSONL file of labeled emails")
+    parser.add_argument("--output", default="classifier.npz", help="file the classifier is written to")
+    parser.add_argument("--head", choices=("centroid", "logistic"), default="centroid")
+    parser.add_argument("--threshold", type=float, default=CLASSIFIER_THRESHOLD,
+                        help="confidence below which emails are escalated")
+    parser.add_argument("--embedding-model", default="text-embedding-3-large")
+    parser.add_argument("--dimensions", type=int, help="length of the embeddings requested (default: the model's)")
+    args = parser.parse_args()
+
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
+    api_key = "voc-00000000000000000000000000000000abcd.12345678"
+    client = get_client(base_url, api_key)
+
+    texts, categories, sentiments = [], [], []
+    with open(args.examples, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                texts.append(email_text({"subject": record.get("subject", ""), "body": record.get("body", "")}))
+                categories.append(record["category"])
+                sentiments.append(record["sentiment"])
+    embeddings = embed_texts(client, texts, args.embedding_model, dimensions=args.dimensions)
+    classifier = EmailClassifier.fit(embeddings, categories, sentiments, head=args.head, threshold=args.threshold,
+                                     embedding_model=args.embedding_model, dimensions=args.dimensions)
+    classifier.save(args.output)
+    print(f"Trained on {len(texts)} emails: categories {classifier.category_head.labels}, "
+          f"sentiments {classifier.sentiment_head.labels}. Written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
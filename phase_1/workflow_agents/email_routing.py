@@ -0,0 +1,336 @@
+"""
+Bulk routing of support emails to teams with RoutingAgent.
+
+Emails are read lazily from mbox files, Maildir directories, single .eml files
+or JSONL dumps ({"id", "from", "subject", "body"} per line), routed in batches
+(one embedding request and one matrix product per batch) and written as JSONL
+decisions as each batch completes. Emails matched by an admin rule
+(workflow_agents.rules) are routed without an embedding. With a trained
+EmailClassifier (workflow_agents.classifier), every embedded email also gets
+a category and a sentiment from the same embedding. A few batches are in flight at a time, so
+memory stays bounded by in_flight * batch_size emails however large the dump.
+
+Run from the phase_1 directory:
+
+    python -m workflow_agents.email_routing inbox.mbox --output decisions.jsonl
+"""
+import argparse
+import contextvars
+import email
+import email.errors
+import json
+import mailbox
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.header import decode_header, make_header
+from email.utils import parseaddr
+
+from .base_agents import AugmentedPromptAgent, RoutingAgent, embed_texts, get_client
+from .classifier import EmailClassifier
+from .embedding_cache import EmbeddingCache
+from .metrics import RoutingMetrics
+from .ingestion import batched
+from .rules import RuleEngine
+from .scheduler import Scheduler
+
+# The teams of the Email Router product spec, as RoutingAgent agents.
+TEAMS = [
+    {
+        "name": "Billing",
+        "description": "Billing issues: invoices, charges, payments, refunds, subscriptions, plans, pricing and receipts.",
+    },
+    {
+        "name": "Technical Support",
+        "description": "Technical problems: errors, bugs, crashes, outages, login and password reset issues, "
+                       "integrations, configuration and performance.",
+    },
+    {
+        "name": "General Inquiries",
+        "description": "General questions, feedback, feature requests, partnerships, account information and "
+                       "anything that is not about billing or a technical problem.",
+    },
+]
+EMAIL_BATCH_SIZE = 256
+EMAIL_IN_FLIGHT = 4
+# Characters of subject and body that are embedded; the rest of a long email
+# rarely changes its topic and only costs tokens.
+EMAIL_TEXT_CHARS = 2000
+
+
+def _header(message, name):
+    value = message.get(name)
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except (UnicodeError, LookupError, email.errors.HeaderParseError):
+        return str(value)
+
+
+def _payload_text(part):
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return ""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+def _body(message):
+    """The plain text of a message, falling back to its HTML part with the tags removed."""
+    html = None
+    for part in message.walk():
+        if part.is_multipart() or part.get_content_disposition() == "attachment":
+            continue
+        if part.get_content_type() == "text/plain":
+            return _payload_text(part)
+        if part.get_content_type() == "text/html" and html is None:
+            html = _payload_text(part)
+    return re.sub(r"<[^>]+>", " ", html) if html is not None else ""
+
+
+def parse_message(message, default_id):
+    """An email.message.Message as a dict with 'id', 'sender', 'subject' and 'body'."""
+    return {
+        "id": _header(message, "Message-ID").strip() or default_id,
+        "sender": parseaddr(_header(message, "From"))[1],
+        "subject": _header(message, "Subject"),
+        "body": _body(message),
+    }
+
+
+def iter_emails(*sources):
+    """
+    Lazily yields emails as dicts with 'id', 'sender', 'subject' and 'body'.
+
+    Each source may be:
+      - a Maildir directory (with cur/ and new/ subdirectories);
+      - a .jsonl file, one {"id", "from" or "sender", "subject", "body"} object per line;
+      - an .eml file, read as a single message;
+      - any other file, read as an mbox.
+
+    Only one message is parsed at a time; mbox files are indexed, not loaded.
+    """
+    for source in sources:
+        path = os.fspath(source)
+        if os.path.isdir(path):
+            box = mailbox.Maildir(path, factory=None, create=False)
+            for key in box.iterkeys():
+                yield parse_message(box[key], f"{path}:{key}")
+        elif path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for line_number, line in enumerate(f):
+                    if line.strip():
+                        record = json.loads(line)
+                        yield {
+                            "id": record.get("id", f"{path}:{line_number}"),
+                            "sender": record.get("from", record.get("sender", "")),
+                            "subject": record.get("subject", ""),
+                            "body": record.get("body", record.get("text", "")),
+                        }
+        elif path.endswith(".eml"):
+            with open(path, "rb") as f:
+                yield parse_message(email.message_from_binary_file(f), path)
+        else:
+            box = mailbox.mbox(path, create=False)
+            try:
+                for key in box.iterkeys():
+                    yield parse_message(box[key], f"{path}:{key}")
+            finally:
+                box.close()
+
+
+def email_text(message, max_chars=EMAIL_TEXT_CHARS):
+    """The text an email is routed by: its subject and the start of its body."""
+    return f"Subject: {message['subject']}\n\n{message['body']}"[:max_chars]
+
+
+def _decision(message, team, rule):
+    return {"id": message["id"], "sender": message["sender"], "subject": message["subject"], "team": team,
+            "rule": rule}
+
+
+class EmailRouter:
+    """
+    Routes streams of emails to teams with a RoutingAgent. The agent's
+    registered agents are the teams; if it has none, the TEAMS of the product
+    spec are registered. Give the agent an EmbeddingCache or a RoutingCache to
+    skip embedding repeated emails. With a RuleEngine, emails that a rule
+    matches go to the rule's team and only the others are embedded. With an
+    EmailClassifier, the embedded emails are also classified; rule-matched
+    emails are not. If the agent has metrics, rule decisions and
+    classifications are recorded there too.
+    """
+    def __init__(self, routing_agent, teams=None, rules=None, classifier=None, batch_size=EMAIL_BATCH_SIZE,
+                 in_flight=EMAIL_IN_FLIGHT, max_chars=EMAIL_TEXT_CHARS):
+        self.routing_agent = routing_agent
+        if teams is not None or not routing_agent.agents:
+            routing_agent.agents = [{"func": None, **team} for team in (teams or TEAMS)]
+        if classifier is not None and (classifier.embedding_model != routing_agent.embedding_model
+                                       or classifier.dimensions != routing_agent.dimensions):
+            raise ValueError(f"The classifier was trained on {classifier.embedding_model} embeddings "
+                             f"(dimensions={classifier.dimensions}), but the routing agent uses "
+                             f"{routing_agent.embedding_model} (dimensions={routing_agent.dimensions}).")
+        self.rules = rules
+        self.classifier = classifier
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+        self.max_chars = max_chars
+
+    def route_batch(self, emails):
+        """
+        Routes a list of emails together and returns one decision dict per
+        email. 'rule' names the rule that chose the team, or is None if the
+        email was routed by its embedding; classified emails also have the
+        classifier's 'category', 'sentiment', confidences and 'escalated'.
+        """
+        metrics = self.routing_agent.metrics
+        decisions = [None] * len(emails)
+        unmatched = []
+        rule_seconds = 0.0
+        for i, message in enumerate(emails):
+            start = time.perf_counter()
+            rule = self.rules.match(message) if self.rules is not None else None
+            if rule is None:
+                unmatched.append(i)
+            else:
+                decisions[i] = _decision(message, rule["team"], rule["name"])
+                rule_seconds += time.perf_counter() - start
+        matched = [decision["team"] for decision in decisions if decision is not None]
+        if metrics is not None and matched:
+            # Only the time spent on the emails a rule routed; the others
+            # count towards the embedding route instead.
+            metrics.record_routing(matched, rule_seconds, "rule")
+        if unmatched:
+            texts = [email_text(emails[i], self.max_chars) for i in unmatched]
+            if self.classifier is None:
+                teams = self.routing_agent.select_agents(texts)
+                labels = [{}] * len(texts)
+            else:
+                # One embedding per email serves both routing and classification.
+                start = time.perf_counter()
+                embeddings = embed_texts(self.routing_agent.client, texts, self.routing_agent.embedding_model,
+                                         cache=self.routing_agent.embedding_cache,
+                                         dimensions=self.routing_agent.dimensions)
+                teams = self.routing_agent.agents_for_embeddings(embeddings, start)
+                labels = self.classifier.classify(embeddings, texts)
+            for i, team, label in zip(unmatched, teams, labels):
+                decisions[i] = {**_decision(emails[i], team["name"] if team is not None else None, None), **label}
+                if metrics is not None and label:
+                    metrics.record_classification(label["category"], label["sentiment"], label["escalated"])
+        return decisions
+
+    def route(self, emails):
+        """
+        Lazily yields the decision for every email, in input order. Up to
+        in_flight batches are routed concurrently while the next are read.
+        """
+        # Embed the team descriptions once, before the workers race to do it.
+        self.routing_agent.select_agents([])
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.in_flight) as pool:
+            for batch in batched(emails, self.batch_size):
+                pending.append(pool.submit(contextvars.copy_context().run, self.route_batch, batch))
+                if len(pending) >= self.in_flight:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def run(self, emails, output):
+        """
+        Routes every email and writes the decisions to output (a path or a text
+        file) as JSON lines, flushing after each batch. Returns the number of
+        emails routed per team, by rules and escalated by the classifier, and
+        the throughput.
+        """
+        start = time.perf_counter()
+        counts = {}
+        by_rule = 0
+        escalated = 0
+        f = open(output, "w") if isinstance(output, (str, os.PathLike)) else output
+        try:
+            for count, decision in enumerate(self.route(emails), 1):
+                f.write(json.dumps(decision) + "\n")
+                counts[decision["team"]] = counts.get(decision["team"], 0) + 1
+                by_rule += decision["rule"] is not None
+                escalated += decision.get("escalated", False)
+                if count % self.batch_size == 0:
+                    f.flush()
+            f.flush()
+        finally:
+            if f is not output:
+                f.close()
+        seconds = time.perf_counter() - start
+        total = sum(counts.values())
+        return {
+            "emails": total,
+            "teams": counts,
+            "routed_by_rules": by_rule,
+            "escalated": escalated,
+            "seconds": round(seconds, 3),
+            "emails_per_minute": round(60 * total / seconds, 1) if seconds else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="mbox files, Maildir directories, .eml or JSONL files")
+    parser.add_argument("--output", default="-", help="JSONL file for the decisions (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=EMAIL_BATCH_SIZE, help="emails embedded per request")
+    parser.add_argument("--in-flight", type=int, default=EMAIL_IN_FLIGHT, help="batches routed at the same time")
+    parser.add_argument("--max-chars", type=int, default=EMAIL_TEXT_CHARS, help="characters of each email embedded")
+    parser.add_argument("--rules", help="JSON file of routing rules applied before embedding-based routing")
+    parser.add_argument("--classifier", help="EmailClassifier file (see workflow_agents.classifier) to "
+                                             "categorize and score the sentiment of the emails")
+    parser.add_argument("--escalate", action="store_true",
+                        help="classify low-confidence emails with a chat model instead")
+    parser.add_argument("--metrics", help="write routing metrics in the Prometheus text format to this file")
+    parser.add_argument("--embedding-cache", help="directory of an EmbeddingCache to reuse embeddings")
+    parser.add_argument("--dimensions", type=int, help="length of the embeddings requested (default: the model's)")
+    parser.add_argument("--rpm", type=int, help="requests per minute sent to the embedding model")
+    parser.add_argument("--tpm", type=int, help="tokens per minute sent to the embedding model")
+    args = parser.parse_args()
+
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
+    api_key = "voc-00000000000000000000000000000000abcd.12345678"
+
+    limits = {name: value for name, value in (("rpm", args.rpm), ("tpm", args.tpm)) if value}
+    scheduler = Scheduler(default_limits=limits)
+    embedding_cache = EmbeddingCache(args.embedding_cache) if args.embedding_cache else None
+    metrics = RoutingMetrics()
+    routing_agent = RoutingAgent(base_url, api_key, embedding_cache=embedding_cache, metrics=metrics,
+                                 dimensions=args.dimensions, client=scheduler.wrap(get_client(base_url, api_key)))
+    rules = RuleEngine.from_file(args.rules) if args.rules else None
+    classifier = None
+    if args.classifier:
+        escalation_agent = None
+        if args.escalate:
+            escalation_agent = AugmentedPromptAgent(base_url, "You are a support email triage assistant.", api_key,
+                                                    client=routing_agent.client)
+        classifier = EmailClassifier.load(args.classifier, escalation_agent=escalation_agent)
+    router = EmailRouter(routing_agent, rules=rules, classifier=classifier, batch_size=args.batch_size,
+                         in_flight=args.in_flight, max_chars=args.max_chars)
+    try:
+        stats = router.run(iter_emails(*args.sources), sys.stdout if args.output == "-" else args.output)
+    finally:
+        if embedding_cache is not None:
+            embedding_cache.close()
+    print(f"Routed {stats['emails']} emails in {stats['seconds']:.1f} s "
+          f"({stats['emails_per_minute']:.0f} per minute, {stats['routed_by_rules']} by rules, "
+          f"{stats['escalated']} escalated): {stats['teams']}", file=sys.stderr)
+    print(f"Scheduler: {scheduler.stats()}", file=sys.stderr)
+    for source, latency in metrics.snapshot()["latency"].items():
+        print(f"Routing latency ({source}): mean {1000 * latency['mean']:.2f} ms, "
+              f"p99 {1000 * latency['p99']:.2f} ms", file=sys.stderr)
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(metrics.to_prometheus())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text):
+    """Collapses all runs of whitespace so trivially different texts share a cache entry."""
+    return " ".join(text.split())
+
+
+def cache_key(model, text):
+    """Content address of an embedding: a hash of the model name and the normalized text."""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+def _file_stem(directory, model):
+    """Path prefix of a model's cache files."""
+    return os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model))
+
+
+class _ModelStore:
+    """
+    The vectors of one embedding model: a float32 memory-mapped matrix on disk
+    plus an append-only index log mapping cache keys to matrix rows.
+    """
+    def __init__(self, directory, model, dim, max_entries):
+        self.dim = dim
+        self.max_entries = max_entries
+        stem = _file_stem(directory, model)
+        self.vectors_path = f"{stem}.f32"
+        self.index_path = f"{stem}.index"
+        self.meta_path = f"{stem}.json"
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != dim:
+                raise ValueError(f"Cache for model '{model}' holds {meta['dim']}-dim vectors, got {dim}.")
+        else:
+            with open(self.meta_path, "w") as f:
+                json.dump({"model": model, "dim": dim}, f)
+
+        # key -> row, ordered from least to most recently used.
+        self.rows = OrderedDict()
+        self._log_lines = 0
+        if os.path.exists(self.index_path):
+            self._truncate_partial_line()
+            owners = {}
+            with open(self.index_path) as f:
+                for line in f:
+                    try:
+                        key, row = line.split()
+                        row = int(row)
+                    except ValueError:
+                        # A damaged entry is just a miss.
+                        continue
+                    # A reused row invalidates whichever key held it before.
+                    previous = owners.get(row)
+                    if previous is not None and previous != key:
+                        self.rows.pop(previous, None)
+                    owners[row] = key
+                    self.rows.pop(key, None)
+                    self.rows[key] = row
+                    self._log_lines += 1
+        while len(self.rows) > max_entries:
+            self.rows.popitem(last=False)
+        self.free_rows = []
+        self.matrix = None
+        self._open_matrix(max(len(self.rows), 1))
+        used = set(self.rows.values())
+        self.free_rows = [row for row in range(self.capacity) if row not in used]
+        self._log = open(self.index_path, "a")
+
+    def _truncate_partial_line(self):
+        """
+        Cuts off a last line left half-written by a killed process, so the next
+        entry appended to the log does not run into it.
+        """
+        with open(self.index_path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Step back in blocks to the last complete line.
+            end = size
+            while end > 0:
+                start = max(0, end - 4096)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    f.truncate(start + newline + 1)
+                    return
+                end = start
+            f.truncate(0)
+
+    @property
+    def capacity(self):
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    def _open_matrix(self, min_rows):
+        """(Re)opens the memory map with room for at least min_rows vectors."""
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        rows = max(size // row_bytes, min_rows)
+        if rows * row_bytes != size:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(rows * row_bytes)
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _allocate_row(self):
+        """Returns a free row, evicting the least recently used entry or growing the file."""
+        if len(self.rows) >= self.max_entries:
+            _, row = self.rows.popitem(last=False)
+            return row
+        if not self.free_rows:
+            old_capacity = self.capacity
+            self._open_matrix(min(old_capacity * 2, self.max_entries))
+            self.free_rows = list(range(self.capacity - 1, old_capacity - 1, -1))
+        return self.free_rows.pop()
+
+    def get(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        self.rows.move_to_end(key)
+        return np.array(self.matrix[row])
+
+    def put(self, key, vector):
+        row = self.rows.get(key)
+        if row is None:
+            row = self._allocate_row()
+        self.matrix[row] = vector
+        self.rows[key] = row
+        self.rows.move_to_end(key)
+        self._log.write(f"{key} {row}\n")
+        self._log_lines += 1
+
+    def flush(self):
+        self.matrix.flush()
+        self._log.flush()
+        # Rewrite the log once it is mostly superseded entries; the rewrite also
+        # persists the current least-to-most recently used order.
+        if self._log_lines > 2 * len(self.rows) + 1024:
+            self._log.close()
+            tmp_path = self.index_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(f"{key} {row}\n" for key, row in self.rows.items())
+            os.replace(tmp_path, self.index_path)
+            self._log_lines = len(self.rows)
+            self._log = open(self.index_path, "a")
+
+    def close(self):
+        self.flush()
+        self._log.close()
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of embedding vectors shared by agents.
+
+    Vectors are stored per model in a memory-mapped float32 file next to an
+    index file, so a restarted process reads them from local disk instead of
+    calling the embeddings API. Each model keeps at most max_entries vectors;
+    the least recently used ones are evicted first.
+    """
+    def __init__(self, directory=".embedding_cache", max_entries=100_000):
+        """
+        Opens (or creates) a cache in the given directory.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1.")
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stores = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _store(self, model, dim=None):
+        store = self._stores.get(model)
+        if store is None and dim is not None:
+            store = _ModelStore(self.directory, model, dim, self.max_entries)
+            self._stores[model] = store
+        elif store is None:
+            # Only open a store from disk on lookup if one was written before.
+            meta_path = f"{_file_stem(self.directory, model)}.json"
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    store = self._store(model, json.load(f)["dim"])
+        return store
+
+    def _open_stores(self):
+        """Opens the store of every model written to the directory, also by earlier processes."""
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+                if meta.get("model") is not None and meta["model"] not in self._stores:
+                    self._store(meta["model"], meta["dim"])
+
+    def get_many(self, model, texts):
+        """
+        Looks up the embeddings of several texts. Returns a list with a float32
+        vector for every hit and None for every miss.
+        """
+        with self._lock:
+            store = self._store(model)
+            if store is None:
+                vectors = [None] * len(texts)
+            else:
+                vectors = [store.get(cache_key(model, text)) for text in texts]
+            hits = sum(vector is not None for vector in vectors)
+            self.hits += hits
+            self.misses += len(texts) - hits
+            return vectors
+
+    def put_many(self, model, texts, vectors):
+        """
+        Stores the embeddings of several texts and writes them through to disk.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        with self._lock:
+            store = self._store(model, vectors.shape[1])
+            for text, vector in zip(texts, vectors):
+                store.put(cache_key(model, text), vector)
+            store.flush()
+
+    def get(self, model, text):
+        """Returns the cached embedding of a single text, or None."""
+        return self.get_many(model, [text])[0]
+
+    def put(self, model, text, vector):
+        """Stores the embedding of a single text."""
+        self.put_many(model, [text], [vector])
+
+    def __len__(self):
+        with self._lock:
+            self._open_stores()
+            return sum(len(store.rows) for store in self._stores.values())
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups served from the cache since it was opened."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """Returns the hit/miss counters and the number of cached vectors per model."""
+        with self._lock:
+            self._open_stores()
+            entries = {model: len(store.rows) for model, store in self._stores.items()}
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate, "entries": entries}
+
+    def close(self):
+        """Flushes every model store and closes its files."""
+        with self._lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores = {}
@@ -0,0 +1,45 @@
+import json
+import os
+from itertools import islice
+
+
+def iter_documents(*sources, extensions=(".txt", ".md"), encoding="utf-8"):
+    """
+    Lazily yields (document_id, text) pairs for RAGKnowledgePromptAgent.add_documents.
+
+    Each source may be:
+      - a directory, walked recursively for files with one of the extensions;
+      - a .jsonl file, one {"id": ..., "text": ...} object per line;
+      - any other file path, read as one document whose id is the path;
+      - an iterable of texts or (document_id, text) pairs, passed through.
+
+    Only one file (or one JSONL line) is held in memory at a time.
+    """
+    for source in sources:
+        if isinstance(source, (str, os.PathLike)):
+            path = os.fspath(source)
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.endswith(extensions) or name.endswith(".jsonl"):
+                            yield from iter_documents(os.path.join(root, name), encoding=encoding)
+            elif path.endswith(".jsonl"):
+                with open(path, encoding=encoding) as f:
+                    for line_number, line in enumerate(f):
+                        if line.strip():
+                            record = json.loads(line)
+                            yield record.get("id", f"{path}:{line_number}"), record["text"]
+            else:
+                with open(path, encoding=encoding) as f:
+                    yield path, f.read()
+        else:
+            for document in source:
+                yield document
+
+
+def batched(iterable, size):
+    """Yields lists of up to size consecutive items from any iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
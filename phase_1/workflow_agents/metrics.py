@@ -0,0 +1,298 @@
+import threading
+import time
+
+# Histogram precision: every power of two is split into 2 ** HISTOGRAM_SUB_BITS
+# buckets, so a recorded value is off by at most 1 / 2 ** HISTOGRAM_SUB_BITS
+# (12.5%). Values are kept in microseconds up to 2 ** HISTOGRAM_MAX_BITS (about
+# 71 minutes); larger ones land in the last bucket.
+HISTOGRAM_SUB_BITS = 3
+HISTOGRAM_MAX_BITS = 32
+SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+_BUCKETS = (HISTOGRAM_MAX_BITS - HISTOGRAM_SUB_BITS + 1) << HISTOGRAM_SUB_BITS
+
+
+class _Sharded:
+    """
+    Base class of the metrics: every thread updates its own shard without
+    locking, and reads merge the shards. Only the first update from a new
+    thread takes a lock, to register its shard; the shards of threads that have
+    exited are folded into one at that point, so memory stays bounded when
+    thread pools come and go.
+    """
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []  # (thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                live = []
+                for thread, other in self._shards:
+                    if thread.is_alive():
+                        live.append((thread, other))
+                    else:
+                        self._combine(self._retired, other)
+                self._shards = live + [(threading.current_thread(), shard)]
+            return shard
+
+    def _combine(self, total, shard):
+        """Adds the values of a shard to total."""
+        raise NotImplementedError
+
+    def _merged(self):
+        """All shards combined."""
+        with self._lock:
+            # dict.copy() does not release the GIL, so each copy is consistent.
+            shards = [self._retired.copy()] + [shard.copy() for _, shard in self._shards]
+        total = {}
+        for shard in shards:
+            self._combine(total, shard)
+        return total
+
+
+class Counter(_Sharded):
+    """A monotonically increasing count per combination of label values."""
+    def inc(self, labels=(), amount=1):
+        """Adds amount to the count of a tuple of label values."""
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _combine(self, total, shard):
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def values(self):
+        """The counts, as a dict of label value tuples to totals."""
+        return self._merged()
+
+
+def _bucket(micros):
+    """Histogram bucket of a value in microseconds."""
+    sub_buckets = 1 << HISTOGRAM_SUB_BITS
+    if micros < 2 * sub_buckets:
+        return max(micros, 0)
+    shift = micros.bit_length() - HISTOGRAM_SUB_BITS - 1
+    return min((shift + 1) * sub_buckets + (micros >> shift) - sub_buckets, _BUCKETS - 1)
+
+
+def _bucket_bounds(index):
+    """The [lower, upper) microsecond range of a histogram bucket."""
+    sub_buckets = 1 << HISTOGRAM_SUB_BITS
+    if index < 2 * sub_buckets:
+        return index, index + 1
+    shift = index // sub_buckets - 1
+    top = index % sub_buckets + sub_buckets
+    return top << shift, (top + 1) << shift
+
+
+class Histogram(_Sharded):
+    """
+    A latency histogram per combination of label values, in fixed memory:
+    log-linear (HDR-style) buckets of microseconds, so quantiles have a bounded
+    relative error however many values are recorded.
+    """
+    def observe(self, seconds, labels=(), count=1):
+        """Records a duration count times."""
+        shard = self._shard()
+        buckets = shard.get(labels)
+        if buckets is None:
+            # One slot per bucket, then the sum of the values and their number.
+            buckets = shard[labels] = [0] * (_BUCKETS + 2)
+        buckets[_bucket(int(seconds * 1_000_000))] += count
+        buckets[-2] += seconds * count
+        buckets[-1] += count
+
+    def _combine(self, total, shard):
+        for labels, buckets in shard.items():
+            merged = total.setdefault(labels, [0] * (_BUCKETS + 2))
+            for i, value in enumerate(list(buckets)):
+                if value:
+                    merged[i] += value
+
+    def summaries(self, quantiles=SUMMARY_QUANTILES):
+        """
+        Per tuple of label values: the number of values, their sum and mean,
+        and the requested quantiles (bucket midpoints), all in seconds.
+        """
+        summaries = {}
+        for labels, buckets in self._merged().items():
+            count = buckets[-1]
+            summary = {"count": count, "sum": buckets[-2], "mean": buckets[-2] / count if count else 0.0}
+            for quantile in quantiles:
+                rank = quantile * count
+                seen = 0
+                for index in range(_BUCKETS):
+                    seen += buckets[index]
+                    if seen >= rank and buckets[index]:
+                        lower, upper = _bucket_bounds(index)
+                        summary[f"p{round(100 * quantile):g}"] = (lower + upper) / 2 / 1_000_000
+                        break
+            summaries[labels] = summary
+        return summaries
+
+
+class TimeSeries(_Sharded):
+    """
+    Counts per time bucket over a sliding window: a ring of `buckets` slots of
+    bucket_seconds each, e.g. emails per minute over the last hour.
+    """
+    def __init__(self, name, help_text, bucket_seconds=60, buckets=60):
+        super().__init__(name, help_text)
+        self.bucket_seconds = bucket_seconds
+        self.buckets = buckets
+
+    def add(self, amount=1, now=None):
+        """Adds amount to the bucket of now (default: the current time)."""
+        bucket = int((time.time() if now is None else now) // self.bucket_seconds)
+        shard = self._shard()
+        slot = bucket % self.buckets
+        # Slots hold (bucket, count); a slot left from an older lap is reset.
+        entry = shard.get(slot)
+        shard[slot] = (bucket, entry[1] + amount) if entry is not None and entry[0] == bucket else (bucket, amount)
+
+    def _combine(self, total, shard):
+        for slot, (bucket, count) in shard.items():
+            entry = total.get(slot)
+            if entry is None or entry[0] < bucket:
+                total[slot] = (bucket, count)
+            elif entry[0] == bucket:
+                total[slot] = (bucket, entry[1] + count)
+
+    def series(self, now=None):
+        """(bucket start time, count) pairs for the whole window, oldest first."""
+        last = int((time.time() if now is None else now) // self.bucket_seconds)
+        counts = dict.fromkeys(range(last - self.buckets + 1, last + 1), 0)
+        for bucket, count in self._merged().values():
+            if bucket in counts:
+                counts[bucket] += count
+        return [(bucket * self.bucket_seconds, count) for bucket, count in counts.items()]
+
+
+def _prometheus_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class RoutingMetrics:
+    """
+    Analytics of email and prompt routing: the decisions per team and how they
+    were made (embedding, routing cache or rule), the routing latency, the
+    volume over time and the classified categories and sentiments.
+
+    Latency is per decision: a call that routes n prompts together in s
+    seconds records s / n for each of them, on every route, so the mean is the
+    average routing time per email however the emails were batched.
+
+    Give it to RoutingAgent (metrics=...) to have every decision recorded; an
+    EmailRouter around that agent also records its rule decisions and
+    classifications. Recording only updates thread-local counters: a couple
+    of microseconds per call, next to the milliseconds of an embedding
+    request. Read the results with
+    snapshot(), to_prometheus() or to_dataframe().
+    """
+    def __init__(self, volume_bucket_seconds=60, volume_buckets=60):
+        self.decisions = Counter("routing_decisions_total", "Routing decisions by team and source.",
+                                 ("team", "source"))
+        self.latency = Histogram("routing_latency_seconds",
+                                 "Time to route a prompt (its share of its batch), by source.", ("source",))
+        self.volume = TimeSeries("routing_volume", "Routing decisions per time bucket.",
+                                 volume_bucket_seconds, volume_buckets)
+        self.categories = Counter("email_categories_total", "Classified emails by category.", ("category",))
+        self.sentiments = Counter("email_sentiments_total", "Classified emails by sentiment.", ("sentiment",))
+        self.escalations = Counter("email_escalations_total", "Classifications escalated to a chat model.")
+
+    def record_routing(self, teams, seconds, source):
+        """
+        Records routing decisions made together: the chosen team (agent) names,
+        the seconds the whole call took and how they were made. Each decision
+        is recorded with its share of the call, seconds / len(teams).
+        """
+        if not teams:
+            return
+        for team in teams:
+            self.decisions.inc((team, source))
+        self.latency.observe(seconds / len(teams), (source,), count=len(teams))
+        self.volume.add(len(teams))
+
+    def record_classification(self, category, sentiment, escalated=False):
+        """Records the category and sentiment of a classified email."""
+        self.categories.inc((category,))
+        self.sentiments.inc((sentiment,))
+        if escalated:
+            self.escalations.inc()
+
+    def snapshot(self):
+        """The current values of every metric as plain dicts."""
+        decisions = self.decisions.values()
+        return {
+            "decisions": sum(decisions.values()),
+            "teams": _totals(decisions, 0),
+            "sources": _totals(decisions, 1),
+            "latency": {labels[0]: summary for labels, summary in self.latency.summaries().items()},
+            "volume": self.volume.series(),
+            "categories": {labels[0]: count for labels, count in self.categories.values().items()},
+            "sentiments": {labels[0]: count for labels, count in self.sentiments.values().items()},
+            "escalations": self.escalations.values().get((), 0),
+        }
+
+    def to_prometheus(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for counter in (self.decisions, self.categories, self.sentiments, self.escalations):
+            lines += [f"# HELP {counter.name} {counter.help}", f"# TYPE {counter.name} counter"]
+            # An unlabeled counter is exported as 0 before its first increment.
+            values = counter.values() or ({} if counter.labelnames else {(): 0})
+            for labels, value in values.items():
+                lines.append(f"{counter.name}{_prometheus_labels(counter.labelnames, labels)} {value}")
+        name = self.latency.name
+        lines += [f"# HELP {name} {self.latency.help}", f"# TYPE {name} summary"]
+        for labels, summary in self.latency.summaries().items():
+            for quantile in SUMMARY_QUANTILES:
+                key = f"p{round(100 * quantile):g}"
+                if key in summary:
+                    quantile_label = _prometheus_labels(self.latency.labelnames, labels, [("quantile", quantile)])
+                    lines.append(f"{name}{quantile_label} {summary[key]}")
+            label_text = _prometheus_labels(self.latency.labelnames, labels)
+            lines.append(f"{name}_sum{label_text} {summary['sum']}")
+            lines.append(f"{name}_count{label_text} {summary['count']}")
+        # The volume window as one gauge per time bucket, labeled with its start (Unix seconds).
+        name = self.volume.name
+        lines += [f"# HELP {name} {self.volume.help}", f"# TYPE {name} gauge"]
+        for start, count in self.volume.series():
+            lines.append(f"{name}{_prometheus_labels(('start',), (start,))} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_dataframe(self):
+        """
+        Every metric as a long pandas DataFrame with the columns metric, label,
+        statistic and value. Volume rows have the bucket start time as label.
+        """
+        import pandas as pd
+
+        rows = []
+        for counter in (self.decisions, self.categories, self.sentiments, self.escalations):
+            for labels, value in counter.values().items():
+                rows.append((counter.name, "/".join(map(str, labels)), "count", value))
+        for labels, summary in self.latency.summaries().items():
+            rows += [(self.latency.name, labels[0], statistic, value) for statistic, value in summary.items()]
+        for start, count in self.volume.series():
+            rows.append((self.volume.name, pd.Timestamp(start, unit="s"), "count", count))
+        return pd.DataFrame(rows, columns=["metric", "label", "statistic", "value"])
+
+
+def _totals(counts, position):
+    totals = {}
+    for labels, count in counts.items():
+        totals[labels[position]] = totals.get(labels[position], 0) + count
+    return totals
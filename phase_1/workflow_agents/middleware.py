@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+from openai import AsyncOpenAI
+
+
+class _Endpoint:
+    """Stands in for client.chat.completions or client.embeddings and routes create() through the wrapper."""
+    def __init__(self, wrapper, kind, target):
+        self._wrapper = wrapper
+        self._kind = kind
+        self._target = target
+
+    def create(self, **kwargs):
+        if self._wrapper.is_async:
+            return self._wrapper._call_async(self._kind, self._target.create, kwargs)
+        return self._wrapper._call(self._kind, self._target.create, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+
+class ClientWrapper:
+    """
+    Base class for layers that sit between the agents and an OpenAI or
+    AsyncOpenAI client, such as caching, tracing or scheduling.
+
+    A wrapper looks like the client it wraps: agents call
+    wrapper.chat.completions.create(...) and wrapper.embeddings.create(...)
+    as usual and can be given the wrapper as their client or async_client.
+    Subclasses override _call (and _call_async for async clients); kind is
+    "chat" or "embeddings", create is the wrapped client's create method and
+    kwargs its keyword arguments. Wrappers can be stacked.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.is_async = isinstance(client, AsyncOpenAI) or getattr(client, "is_async", False)
+        self.chat = SimpleNamespace(completions=_Endpoint(self, "chat", client.chat.completions))
+        self.embeddings = _Endpoint(self, "embeddings", client.embeddings)
+
+    def with_options(self, **options):
+        """
+        A copy of this wrapper around client.with_options(**options), e.g.
+        max_retries=0, so client options can be changed through stacked wrappers.
+        """
+        # Not copy.copy(): it would look up __setstate__ through __getattr__ before client is set.
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        ClientWrapper.__init__(clone, self.client.with_options(**options))
+        return clone
+
+    def _call(self, kind, create, kwargs):
+        return create(**kwargs)
+
+    async def _call_async(self, kind, create, kwargs):
+        return await create(**kwargs)
+
+    def __getattr__(self, name):
+        # Everything else (models, files, base_url, ...) goes to the wrapped client.
+        return getattr(self.client, name)
+
+
+def innermost_client(client):
+    """The client at the bottom of a stack of ClientWrappers."""
+    while isinstance(client, ClientWrapper):
+        client = client.client
+    return client
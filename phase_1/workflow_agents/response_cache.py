@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from openai.types.chat import ChatCompletion
+
+from .middleware import ClientWrapper
+
+# Request arguments that do not change the completion and are left out of the key.
+_UNKEYED_ARGUMENTS = {"stream", "stream_options", "timeout", "extra_headers", "user"}
+
+
+def request_key(kwargs):
+    """
+    Cache key of a chat completion request: a hash of the model, the messages
+    and every sampling parameter.
+    """
+    keyed = {name: value for name, value in kwargs.items() if name not in _UNKEYED_ARGUMENTS}
+    payload = json.dumps(keyed, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(kwargs):
+    """Whether a request asks for greedy decoding (temperature 0)."""
+    return kwargs.get("temperature") == 0
+
+
+class ResponseCache:
+    """
+    An opt-in cache of chat completion responses, keyed by model, messages and
+    sampling parameters.
+
+    Responses are kept in an in-memory LRU of at most max_entries items and,
+    if a directory is given, also written to disk so later runs can reuse them.
+    Entries older than ttl seconds (None: never) are treated as missing. By
+    default only deterministic requests (temperature 0) are cached, since
+    replaying a sampled answer changes the behavior of the agents; pass
+    cache_nondeterministic=True to cache every request.
+
+    Use wrap() to put the cache in front of an OpenAI or AsyncOpenAI client and
+    give the result to agents as their client or async_client.
+    """
+    def __init__(self, max_entries=1024, ttl=None, directory=None, cache_nondeterministic=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.cache_nondeterministic = cache_nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (stored_at, response)
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def wrap(self, client):
+        """Returns a client wrapper that serves chat completions from this cache."""
+        return CachingClient(client, self)
+
+    def should_cache(self, kwargs):
+        """Whether a request may be answered from (and stored in) the cache."""
+        if kwargs.get("stream"):
+            return False
+        return self.cache_nondeterministic or is_deterministic(kwargs)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _get_memory(self, key):
+        """The response held in memory for a key, counted as a hit, or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._expired(entry[0]):
+                del self._memory[key]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        return None
+
+    def _get_disk(self, key):
+        """The response stored on disk for a key, or None; counts the hit or miss."""
+        if self.directory and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key)) as f:
+                    record = json.load(f)
+                if not self._expired(record["stored_at"]):
+                    response = ChatCompletion.model_validate(record["response"])
+                    self._remember(key, record["stored_at"], response)
+                    with self._lock:
+                        self.hits += 1
+                    return response
+            except (OSError, ValueError, KeyError):
+                # A corrupt or half-written file is just a miss.
+                pass
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, key):
+        """Returns the cached response for a key, or None."""
+        response = self._get_memory(key)
+        return response if response is not None else self._get_disk(key)
+
+    async def get_async(self, key):
+        """
+        Coroutine version of get(): the memory tier is checked inline and the
+        disk tier is read in a worker thread, so the event loop never blocks on files.
+        """
+        response = self._get_memory(key)
+        if response is not None:
+            return response
+        if not self.directory:
+            return self._get_disk(key)
+        return await asyncio.to_thread(self._get_disk, key)
+
+    def _remember(self, key, stored_at, response):
+        with self._lock:
+            self._memory[key] = (stored_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key, response):
+        """Stores a response in memory and, if configured, on disk."""
+        stored_at = time.time()
+        self._remember(key, stored_at, response)
+        if self.directory:
+            # Write to a temporary file first so readers never see a partial entry.
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"stored_at": stored_at, "response": response.model_dump(mode="json")}, f)
+            os.replace(tmp_path, self._path(key))
+
+    async def put_async(self, key, response):
+        """Coroutine version of put(): the disk tier is written in a worker thread."""
+        if self.directory:
+            await asyncio.to_thread(self.put, key, response)
+        else:
+            self.put(key, response)
+
+    def prune(self):
+        """Deletes expired entries from memory and disk. Returns the number removed."""
+        removed = 0
+        with self._lock:
+            for key in [key for key, (stored_at, _) in self._memory.items() if self._expired(stored_at)]:
+                del self._memory[key]
+                removed += 1
+        if self.directory and self.ttl is not None:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith(".json") and time.time() - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        """Empties the cache, including the disk tier."""
+        with self._lock:
+            self._memory.clear()
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def stats(self):
+        """Returns the hit and miss counters and the number of entries held in memory."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+class CachingClient(ClientWrapper):
+    """
+    Serves chat completions from a ResponseCache and passes everything else,
+    including embeddings and uncacheable requests, to the wrapped client.
+    """
+    def __init__(self, client, cache):
+        super().__init__(client)
+        self.cache = cache
+
+    def _call(self, kind, create, kwargs):
+        if kind != "chat" or not self.cache.should_cache(kwargs):
+            return create(**kwargs)
+        key = request_key(kwargs)
+        response = self.cache.get(key)
+        if response is None:
+            response = create(**kwargs)
+            self.cache.put(key, response)
+        return response
+
+    async def _call_async(self, kind, create, kwargs):
+        if kind != "chat" or not self.cache.should_cache(kwargs):
+            return await create(**kwargs)
+        key = request_key(kwargs)
+        response = await self.cache.get_async(key)
+        if response is None:
+            response = await create(**kwargs)
+            await self.cache.put_async(key, response)
+        return response
@@ -0,0 +1,154 @@
+import json
+import re
+from collections import deque
+
+_WORD = re.compile(r"\w+")
+
+
+def words(text):
+    """The lower-cased words of a text, as keywords are matched on."""
+    return _WORD.findall(text.lower())
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over words. Finds every occurrence of any number of
+    keywords, single words or phrases, in one pass over a text's words, so the
+    cost depends on the length of the text and not on the number of keywords.
+    Keywords match whole words only: "bill" does not match "billing".
+    """
+    def __init__(self, keywords):
+        """keywords is an iterable of (keyword, value) pairs; matches yield the values."""
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for keyword, value in keywords:
+            node = 0
+            for word in words(keyword):
+                child = self._goto[node].get(word)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][word] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = child
+            if node:
+                self._out[node] += (value,)
+        self._link()
+
+    def _link(self):
+        # Breadth-first, so every node's failure link points to a shallower,
+        # already linked node: the longest proper suffix that is a trie path.
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(word, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] += self._out[self._fail[child]]
+
+    def __len__(self):
+        return len(self._goto) - 1
+
+    def find(self, text_words):
+        """Yields the value of every keyword occurring in a sequence of words."""
+        goto, fail, out = self._goto, self._fail, self._out
+        root = goto[0]
+        node = 0
+        for word in text_words:
+            # Most words of a text start no keyword at all.
+            if not node and word not in root:
+                continue
+            while node and word not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(word, 0)
+            if out[node]:
+                yield from out[node]
+
+
+class SenderMatcher:
+    """
+    Matches sender addresses against exact addresses ("ceo@example.com") and
+    domains ("example.com", which also covers its subdomains) with one hash
+    lookup per domain label.
+    """
+    def __init__(self, senders):
+        """senders is an iterable of (address or domain, value) pairs."""
+        self._addresses = {}
+        self._domains = {}
+        for sender, value in senders:
+            sender = sender.strip().lower()
+            table = self._addresses if "@" in sender.strip("@") else self._domains
+            table.setdefault(sender.lstrip("@"), []).append(value)
+
+    def find(self, sender):
+        """Yields the value of every address or domain the sender matches."""
+        sender = sender.strip().lower()
+        yield from self._addresses.get(sender, ())
+        labels = sender.rpartition("@")[2].split(".")
+        for i in range(len(labels)):
+            yield from self._domains.get(".".join(labels[i:]), ())
+
+
+class RuleEngine:
+    """
+    Admin routing rules, compiled for matching emails without any API call.
+
+    Each rule is a dict with the 'team' to route to and any of:
+      - 'keywords': words or phrases matched in the subject or the body;
+      - 'subject_keywords': words or phrases matched in the subject only;
+      - 'senders': sender addresses, or domains that also cover their subdomains;
+      - 'name': shown in the routing decisions (default: "rule <index>").
+    A rule fires if any of its conditions matches. If several rules fire, the
+    first in the list wins, so put the specific rules before the broad ones.
+    """
+    def __init__(self, rules):
+        self.rules = []
+        for index, rule in enumerate(rules):
+            if not rule.get("team"):
+                raise ValueError(f"Rule {index} has no 'team'.")
+            if not any(rule.get(key) for key in ("keywords", "subject_keywords", "senders")):
+                raise ValueError(f"Rule {index} has no 'keywords', 'subject_keywords' or 'senders'.")
+            for key in ("keywords", "subject_keywords", "senders"):
+                # A bare string would otherwise be matched one character at a time.
+                values = rule.get(key, ())
+                if not isinstance(values, (list, tuple)) or not all(isinstance(value, str) for value in values):
+                    raise ValueError(f"Rule {index}: '{key}' must be a list of strings.")
+            self.rules.append({"name": f"rule {index}", **rule})
+        indexed = list(enumerate(self.rules))
+        self._keywords = KeywordMatcher(
+            (keyword, index) for index, rule in indexed for keyword in rule.get("keywords", ())
+        )
+        self._subject_keywords = KeywordMatcher(
+            (keyword, index) for index, rule in indexed
+            for keyword in (*rule.get("keywords", ()), *rule.get("subject_keywords", ()))
+        )
+        self._senders = SenderMatcher((sender, index) for index, rule in indexed for sender in rule.get("senders", ()))
+
+    @classmethod
+    def from_file(cls, path):
+        """Loads the rules from a JSON file holding a list of rule dicts."""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def match(self, message):
+        """
+        Returns the first rule that fires for an email (a dict with 'sender',
+        'subject' and 'body'), or None.
+        """
+        best = min(self._senders.find(message.get("sender", "")), default=None)
+        # A sender match of the first rule cannot be beaten.
+        if best == 0:
+            return self.rules[0]
+        for index in self._subject_keywords.find(words(message.get("subject", ""))):
+            if best is None or index < best:
+                best = index
+        for index in self._keywords.find(words(message.get("body", ""))):
+            if best is None or index < best:
+                best = index
+        return self.rules[best] if best is not None else None
@@ -0,0 +1,345 @@
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from openai import APIConnectionError, APIStatusError, AsyncOpenAI, OpenAI, RateLimitError
+
+from .middleware import ClientWrapper, innermost_client
+
+# Priority classes; lower ranks are served first when a model is throttled.
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# Completion tokens assumed for the tokens/min budget when a request sets no max_tokens.
+DEFAULT_COMPLETION_TOKENS = 256
+
+# Per-call options set with call_options(), e.g. for everything one workflow step does.
+_call_options = contextvars.ContextVar("call_options", default={})
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call cannot be completed before its deadline."""
+
+
+@contextlib.contextmanager
+def call_options(priority=None, deadline=None):
+    """
+    Sets the priority and/or the deadline (seconds from each call's start) of
+    every scheduled call made inside the block, overriding the client's defaults.
+    """
+    options = dict(_call_options.get())
+    if priority is not None:
+        options["priority"] = priority
+    if deadline is not None:
+        options["deadline"] = deadline
+    token = _call_options.set(options)
+    try:
+        yield
+    finally:
+        _call_options.reset(token)
+
+
+def _estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def estimate_request_tokens(kind, kwargs):
+    """Tokens a request is expected to use, charged to the tokens/min budget before it is sent."""
+    if kind == "embeddings":
+        inputs = kwargs.get("input") or ()
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return sum(_estimate_tokens(text) for text in inputs)
+    prompt_tokens = sum(_estimate_tokens(str(message.get("content") or "")) for message in kwargs.get("messages", ()))
+    return prompt_tokens + (kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+
+def retry_after(error):
+    """Seconds the server asked to wait (Retry-After / retry-after-ms headers), or None."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            value = headers["retry-after"]
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def is_retryable(error):
+    """Rate limits, timeouts, connection errors and 5xx responses are worth retrying."""
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code >= 500 or error.status_code in (408, 409))
+
+
+class TokenBucket:
+    """
+    Allows per_minute units per minute, refilled continuously, with bursts of
+    up to capacity units (default: ten seconds' worth). A request larger than
+    the capacity is let through when the bucket is full.
+    """
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, per_minute / 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now, amount):
+        """Seconds until amount units are available (0 if they are now)."""
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, amount):
+        """Uses amount units; negative amounts give units back."""
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class _ModelLimiter:
+    """The buckets of one model, the calls waiting for them and any server-imposed pause."""
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.waiting = []  # heap of (priority rank, sequence number)
+        self.paused_until = 0.0
+
+    def wait_time(self, now, tokens):
+        wait = max(0.0, self.paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(now, 1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(now, tokens))
+        return wait
+
+    def take(self, tokens):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(tokens)
+
+
+class Scheduler:
+    """
+    Central gate for API calls: enforces requests/min and tokens/min limits per
+    model, serves waiting calls by priority, and retries rate limits,
+    timeouts, connection errors and 5xx responses with jittered exponential
+    backoff, honoring Retry-After. A 429 pauses every call to that model for
+    the time the server asked for.
+
+    limits maps model names to {"rpm": ..., "tpm": ...}; default_limits applies
+    to other models (None: unlimited). Use wrap() to route an agent's client
+    through the scheduler.
+    """
+    def __init__(self, limits=None, default_limits=None, max_retries=5, base_delay=0.5, max_delay=30.0, seed=None):
+        self.limits = limits or {}
+        self.default_limits = default_limits or {}
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random.Random(seed)
+        self._limiters = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {"calls": 0, "retries": 0, "rate_limited": 0, "failed": 0,
+                       "deadline_exceeded": 0, "throttled_seconds": 0.0}
+
+    def wrap(self, client, priority="normal", deadline=None):
+        """Returns a client wrapper whose calls go through this scheduler."""
+        return ScheduledClient(client, self, priority=priority, deadline=deadline)
+
+    def stats(self):
+        with self._condition:
+            return dict(self._stats)
+
+    def _limiter(self, model):
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            limits = self.limits.get(model, self.default_limits)
+            limiter = self._limiters[model] = _ModelLimiter(limits.get("rpm"), limits.get("tpm"))
+        return limiter
+
+    @staticmethod
+    def _rank(priority):
+        return PRIORITIES[priority] if isinstance(priority, str) else int(priority)
+
+    def _try_acquire(self, limiter, ticket, tokens, deadline_at):
+        """
+        One admission attempt, under the lock. Returns 0 once the call may go
+        ahead, otherwise the seconds to wait before trying again (None: until
+        notified).
+        """
+        now = time.monotonic()
+        if deadline_at is not None and now >= deadline_at:
+            self._stats["deadline_exceeded"] += 1
+            raise DeadlineExceeded("The call's deadline passed while it was waiting for its rate limit.")
+        wait = None
+        if limiter.waiting[0] == ticket:
+            wait = limiter.wait_time(now, tokens)
+            if wait == 0:
+                limiter.take(tokens)
+                return 0.0
+        if deadline_at is not None:
+            wait = min(wait, deadline_at - now) if wait is not None else deadline_at - now
+        return wait
+
+    def _leave(self, limiter, ticket):
+        limiter.waiting.remove(ticket)
+        heapq.heapify(limiter.waiting)
+        self._condition.notify_all()
+
+    def _acquire(self, model, tokens, priority, deadline_at):
+        start = time.monotonic()
+        with self._condition:
+            limiter = self._limiter(model)
+            ticket = (self._rank(priority), next(self._sequence))
+            heapq.heappush(limiter.waiting, ticket)
+            try:
+                while True:
+                    wait = self._try_acquire(limiter, ticket, tokens, deadline_at)
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+            finally:
+                self._leave(limiter, ticket)
+                self._stats["throttled_seconds"] += time.monotonic() - start
+
+    async def _acquire_async(self, model, tokens, priority, deadline_at):
+        start = time.monotonic()
+        with self._condition:
+            limiter = self._limiter(model)
+            ticket = (self._rank(priority), next(self._sequence))
+            heapq.heappush(limiter.waiting, ticket)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_acquire(limiter, ticket, tokens, deadline_at)
+                if wait == 0:
+                    break
+                # The event loop cannot block on the condition, so poll.
+                await asyncio.sleep(min(wait, 0.05) if wait is not None else 0.01)
+        finally:
+            with self._condition:
+                self._leave(limiter, ticket)
+                self._stats["throttled_seconds"] += time.monotonic() - start
+
+    def _retry_delay(self, error, attempt, model, deadline_at):
+        """Seconds to wait before retrying after error; raises if the call should not be retried."""
+        if not is_retryable(error) or attempt >= self.max_retries:
+            with self._condition:
+                self._stats["failed"] += 1
+            raise error
+        requested = retry_after(error)
+        if requested is not None:
+            delay = requested
+        else:
+            # Full jitter keeps concurrent callers from retrying in lockstep.
+            delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        with self._condition:
+            self._stats["retries"] += 1
+            if isinstance(error, RateLimitError):
+                self._stats["rate_limited"] += 1
+                if requested is not None:
+                    limiter = self._limiter(model)
+                    limiter.paused_until = max(limiter.paused_until, time.monotonic() + requested)
+        if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+            with self._condition:
+                self._stats["deadline_exceeded"] += 1
+            raise DeadlineExceeded("The call's deadline would pass before it could be retried.") from error
+        return delay
+
+    def _settle(self, model, estimated_tokens, response):
+        """Corrects the tokens/min budget with the usage the response reports."""
+        usage = getattr(response, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        with self._condition:
+            self._stats["calls"] += 1
+            limiter = self._limiter(model)
+            if isinstance(total_tokens, int) and limiter.tokens is not None:
+                limiter.tokens.take(total_tokens - estimated_tokens)
+
+    @staticmethod
+    def _with_timeout(kwargs, deadline_at):
+        if deadline_at is None:
+            return kwargs
+        return {**kwargs, "timeout": max(0.001, deadline_at - time.monotonic())}
+
+    def call(self, create, kwargs, kind="chat", priority="normal", deadline=None):
+        """
+        Runs create(**kwargs) under the rate limits, retrying transient errors.
+        deadline is in seconds from now; it bounds both the waiting and the
+        request itself (as its timeout). Raises DeadlineExceeded if it passes.
+        """
+        model = kwargs.get("model")
+        tokens = estimate_request_tokens(kind, kwargs)
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        for attempt in itertools.count():
+            self._acquire(model, tokens, priority, deadline_at)
+            try:
+                response = create(**self._with_timeout(kwargs, deadline_at))
+            except Exception as error:
+                time.sleep(self._retry_delay(error, attempt, model, deadline_at))
+                continue
+            self._settle(model, tokens, response)
+            return response
+
+    async def call_async(self, create, kwargs, kind="chat", priority="normal", deadline=None):
+        """
+        Coroutine version of call() for AsyncOpenAI clients.
+        """
+        model = kwargs.get("model")
+        tokens = estimate_request_tokens(kind, kwargs)
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        for attempt in itertools.count():
+            await self._acquire_async(model, tokens, priority, deadline_at)
+            try:
+                response = await create(**self._with_timeout(kwargs, deadline_at))
+            except Exception as error:
+                await asyncio.sleep(self._retry_delay(error, attempt, model, deadline_at))
+                continue
+            self._settle(model, tokens, response)
+            return response
+
+
+class ScheduledClient(ClientWrapper):
+    """
+    Sends every chat and embedding call through a Scheduler with the given
+    default priority and deadline; call_options() overrides them for a block.
+    The OpenAI client's own retries are turned off, as the scheduler retries,
+    also when it is wrapped in other ClientWrappers (caching, tracing).
+    """
+    def __init__(self, client, scheduler, priority="normal", deadline=None):
+        if isinstance(innermost_client(client), (OpenAI, AsyncOpenAI)):
+            client = client.with_options(max_retries=0)
+        super().__init__(client)
+        self.scheduler = scheduler
+        self.priority = priority
+        self.deadline = deadline
+
+    def _options(self):
+        options = _call_options.get()
+        return options.get("priority", self.priority), options.get("deadline", self.deadline)
+
+    def _call(self, kind, create, kwargs):
+        priority, deadline = self._options()
+        return self.scheduler.call(create, kwargs, kind=kind, priority=priority, deadline=deadline)
+
+    async def _call_async(self, kind, create, kwargs):
+        priority, deadline = self._options()
+        return await self.scheduler.call_async(create, kwargs, kind=kind, priority=priority, deadline=deadline)
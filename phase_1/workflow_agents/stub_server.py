@@ -0,0 +1,351 @@
+"""
+A local stand-in for the OpenAI API, for running and benchmarking the agents
+without network access.
+
+It implements POST /v1/chat/completions (including streaming) and
+POST /v1/embeddings. Embeddings are deterministic: every word of the input is
+hashed onto a few dimensions, so texts that share words get similar vectors and
+routing and retrieval behave sensibly. Completions echo the last user message
+unless a scripted reply matches it. Latency, jitter, server errors and rate
+limiting (429 with Retry-After) can be injected.
+
+Run it from the phase_1 directory and point the scripts at it:
+
+    python -m workflow_agents.stub_server --port 8000 --latency 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python direct_prompt_agent.py
+
+or start it in-process:
+
+    with StubServer(latency=0.05) as server:
+        agent = DirectPromptAgent(server.url, "stub-key")
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Dimensions of the real models, used when a request does not ask for fewer.
+MODEL_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+DEFAULT_DIMENSIONS = 1536
+# Every word is spread over this many hashed dimensions.
+FEATURES_PER_WORD = 4
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token), used for the usage figures."""
+    return len(text) // 4 + 1
+
+
+def fake_embedding(text, dimensions=DEFAULT_DIMENSIONS):
+    """
+    Deterministic unit-length embedding of a text: each lower-cased word adds
+    +-1 on FEATURES_PER_WORD hashed dimensions.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=4 * FEATURES_PER_WORD).digest()
+        for i in range(FEATURES_PER_WORD):
+            feature = int.from_bytes(digest[4 * i:4 * i + 4], "little")
+            vector[feature % dimensions] += 1.0 if feature & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        # Texts without words still get a well-defined, deterministic vector.
+        vector[int(hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest(), 16) % dimensions] = 1.0
+        return vector
+    return vector / norm
+
+
+class StubServer:
+    """
+    An OpenAI-compatible HTTP server on a background thread.
+
+    latency and jitter (seconds) delay every response by latency plus a uniform
+    random amount in [-jitter, jitter]; token_latency additionally delays each
+    streamed chunk. error_rate is the fraction of requests answered with a 500
+    and rate_limit_rate the fraction answered with a 429; requests_per_minute,
+    if set, enforces a real limit and answers 429 once it is exceeded. Both
+    kinds of 429 carry a Retry-After header of retry_after seconds.
+
+    responses is a list of (pattern, reply) pairs: the first regular expression
+    found in the last message of a chat request picks the reply, otherwise the
+    message is echoed back. Replies are cut to max_tokens words if the request
+    sets it. Request counts are available from stats().
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, token_latency=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, requests_per_minute=None, retry_after=1.0,
+                 responses=(), seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.responses = [(re.compile(pattern), reply) for pattern, reply in responses]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._request_times = []
+        self._counts = {"chat": 0, "embeddings": 0, "errors": 0, "rate_limited": 0}
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL to give the agents, e.g. http://127.0.0.1:8000/v1."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Starts serving on a background thread and returns self."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serves on the calling thread until interrupted."""
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        """Returns the number of chat and embedding requests served and of injected failures."""
+        with self._lock:
+            return dict(self._counts)
+
+    def _delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(0.0, self.latency + jitter)
+
+    def _failure(self):
+        """Decides whether a request fails: returns (status, extra headers), or None."""
+        with self._lock:
+            now = time.monotonic()
+            if self.requests_per_minute is not None:
+                self._request_times = [t for t in self._request_times if now - t < 60.0]
+                if len(self._request_times) >= self.requests_per_minute:
+                    self._counts["rate_limited"] += 1
+                    return 429, {"Retry-After": str(self.retry_after)}
+                self._request_times.append(now)
+            draw = self._random.random()
+            if draw < self.error_rate:
+                self._counts["errors"] += 1
+                return 500, {}
+            if draw < self.error_rate + self.rate_limit_rate:
+                self._counts["rate_limited"] += 1
+                return 429, {"Retry-After": str(self.retry_after)}
+        return None
+
+    def _count(self, kind):
+        with self._lock:
+            self._counts[kind] += 1
+
+    def reply(self, messages):
+        """The completion text for a list of chat messages."""
+        last = messages[-1]["content"] if messages else ""
+        if not isinstance(last, str):
+            last = json.dumps(last)
+        for pattern, reply in self.responses:
+            if pattern.search(last):
+                return reply
+        return f"Echo: {last}"
+
+    def _completion(self, body):
+        """The reply to a chat request, cut to max_tokens words if given, and its finish reason."""
+        content = self.reply(body.get("messages", []))
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        words = re.findall(r"\S+\s*", content)
+        if max_tokens and len(words) > max_tokens:
+            return "".join(words[:max_tokens]).rstrip(), "length"
+        return content, "stop"
+
+    def embeddings_response(self, body):
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        model = body.get("model", "text-embedding-3-large")
+        dimensions = body.get("dimensions") or MODEL_DIMENSIONS.get(model, DEFAULT_DIMENSIONS)
+        tokens = sum(estimate_tokens(text) for text in inputs)
+        # The openai client asks for base64 (packed float32) by default, which
+        # it decodes much faster than lists of floats.
+        if body.get("encoding_format") == "base64":
+            encode = lambda vector: base64.b64encode(vector.astype(np.float32).tobytes()).decode("ascii")
+        else:
+            encode = lambda vector: vector.tolist()
+        return {
+            "object": "list",
+            "model": model,
+            "data": [
+                {"object": "embedding", "index": i, "embedding": encode(fake_embedding(text, dimensions))}
+                for i, text in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def chat_response(self, body):
+        content, finish_reason = self._completion(body)
+        usage = self._usage(body, content)
+        return {
+            "id": f"chatcmpl-stub-{self._random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        }
+
+    def chat_chunks(self, body):
+        """The server-sent event payloads of a streamed chat completion."""
+        content, finish_reason = self._completion(body)
+        base = {
+            "id": f"chatcmpl-stub-{self._random.getrandbits(32):08x}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-3.5-turbo"),
+        }
+        # One chunk per word (with its trailing space), like a token stream.
+        for piece in re.findall(r"\S+\s*|\s+", content):
+            yield {**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+        yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield {**base, "choices": [], "usage": self._usage(body, content)}
+
+    @staticmethod
+    def _usage(body, content):
+        prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+        completion_tokens = len(content.split())
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately; without this, Nagle's
+        # algorithm and delayed ACKs add ~40 ms to every keep-alive request.
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            # Keep benchmark output clean.
+            pass
+
+        def _send_json(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_stream(self, chunks):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for chunk in chunks:
+                self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                if server.token_latency:
+                    time.sleep(server.token_latency)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _write_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": {"message": "Invalid JSON body.", "type": "invalid_request_error"}})
+                return
+
+            path = self.path.rstrip("/")
+            if path.endswith("/chat/completions"):
+                kind = "chat"
+            elif path.endswith("/embeddings"):
+                kind = "embeddings"
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}.", "type": "invalid_request_error"}})
+                return
+
+            time.sleep(server._delay())
+            failure = server._failure()
+            if failure is not None:
+                status, headers = failure
+                error_type = "rate_limit_error" if status == 429 else "server_error"
+                self._send_json(status, {"error": {"message": "Injected failure.", "type": error_type}}, headers)
+                return
+
+            server._count(kind)
+            if kind == "embeddings":
+                self._send_json(200, server.embeddings_response(body))
+            elif body.get("stream"):
+                self._send_stream(server.chat_chunks(body))
+            else:
+                self._send_json(200, server.chat_response(body))
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +- jitter on the latency, in seconds.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between streamed chunks.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--requests-per-minute", type=int, default=None, help="Answer 429 above this rate.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--responses", help='JSON file with a list of ["pattern", "reply"] pairs.')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    responses = ()
+    if args.responses:
+        with open(args.responses) as f:
+            responses = json.load(f)
+    server = StubServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                        token_latency=args.token_latency, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, requests_per_minute=args.requests_per_minute,
+                        retry_after=args.retry_after, responses=responses, seed=args.seed)
+    print(f"Stub OpenAI server listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+
+from .middleware import ClientWrapper
+
+# The span that new spans are opened under. Context variables follow asyncio
+# tasks automatically; thread pools must run their work in a copy of the
+# caller's context (contextvars.copy_context().run) to keep the tree intact.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Agent methods wrapped by instrument(), where the agent has them.
+TRACED_METHODS = (
+    "respond", "respond_async", "respond_stream", "respond_stream_async",
+    "evaluate", "evaluate_async",
+    "route", "route_async", "select_agent", "select_agent_async", "select_agents", "select_agents_async",
+    "retrieve", "retrieve_async", "add_documents",
+    "extract_steps_from_prompt", "extract_steps_async",
+    "extract_step_graph_from_prompt", "extract_step_graph_async",
+)
+
+
+class Span:
+    """
+    One timed operation: an agent method ("agent" spans), an API call ("llm"
+    spans) or any block opened with Tracer.span(). Spans nest: every span
+    records the spans opened while it was current as its children.
+    """
+    def __init__(self, span_id, name, kind, parent, attributes):
+        self.span_id = span_id
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.attributes = attributes
+        self.children = []
+        self.start = time.perf_counter()
+        self.start_time = time.time()
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        """Seconds from start to end, or so far if the span is still open."""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    @property
+    def agent(self):
+        """The name of the agent this span belongs to: its own, or the nearest enclosing one."""
+        span = self
+        while span is not None:
+            if "agent" in span.attributes:
+                return span.attributes["agent"]
+            span = span.parent
+        return None
+
+    def to_dict(self):
+        """The span and its children as plain JSON-serializable dicts."""
+        return {
+            "id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent is not None else None,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "duration_ms": round(1000 * self.duration, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class Tracer:
+    """
+    Collects spans into trees. Wrap clients with TracedClient (or whole agents
+    with instrument()) to record every chat and embedding call with its
+    latency, model, token usage and calling agent, then inspect the result
+    with format_tree(), summary() or export().
+    """
+    def __init__(self):
+        self.roots = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_span(self, name, kind="internal", **attributes):
+        """Opens a span under the current one. Close it with finish_span()."""
+        parent = _current_span.get()
+        span = Span(next(self._ids), name, kind, parent, attributes)
+        with self._lock:
+            (parent.children if parent is not None else self.roots).append(span)
+        return span
+
+    def finish_span(self, span, error=None):
+        span.end = time.perf_counter()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+
+    def span(self, name, kind="internal", **attributes):
+        """
+        Context manager that opens a span and makes it current, so spans opened
+        inside it become its children.
+        """
+        return _SpanContext(self, name, kind, attributes)
+
+    def _walk(self):
+        stack = list(self.roots)
+        while stack:
+            span = stack.pop()
+            yield span
+            stack.extend(span.children)
+
+    def summary(self):
+        """
+        Totals of the API calls per calling agent: number of calls, seconds spent
+        waiting on them and prompt / completion tokens.
+        """
+        totals = {}
+        for span in self._walk():
+            if span.kind != "llm":
+                continue
+            agent = totals.setdefault(span.agent or "(no agent)", {
+                "calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            agent["calls"] += 1
+            agent["seconds"] += span.duration
+            agent["prompt_tokens"] += span.attributes.get("prompt_tokens") or 0
+            agent["completion_tokens"] += span.attributes.get("completion_tokens") or 0
+        return totals
+
+    def to_dict(self):
+        return {"spans": [span.to_dict() for span in self.roots], "summary": self.summary()}
+
+    def export(self, path):
+        """Writes the span trees and the per-agent summary to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def format_tree(self):
+        """The span trees as indented text, one line per span."""
+        lines = []
+
+        def add(span, depth):
+            details = [f"{1000 * span.duration:.1f} ms"]
+            if span.kind == "llm":
+                details.append(span.attributes.get("model", ""))
+                if span.attributes.get("total_tokens") is not None:
+                    details.append(f"{span.attributes['prompt_tokens']}+{span.attributes.get('completion_tokens') or 0} tokens")
+            if span.error:
+                details.append(f"error: {span.error}")
+            lines.append(f"{'  ' * depth}{span.name} ({', '.join(d for d in details if d)})")
+            for child in sorted(span.children, key=lambda child: child.start):
+                add(child, depth + 1)
+
+        for root in self.roots:
+            add(root, 0)
+        return "\n".join(lines)
+
+
+class _SpanContext:
+    def __init__(self, tracer, name, kind, attributes):
+        self._tracer = tracer
+        self._args = (name, kind, attributes)
+        self._token = None
+
+    def __enter__(self):
+        name, kind, attributes = self._args
+        self.span = self._tracer.start_span(name, kind, **attributes)
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        _current_span.reset(self._token)
+        self._tracer.finish_span(self.span, exc)
+        return False
+
+
+def _record_usage(span, response):
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        span.attributes["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+        span.attributes["completion_tokens"] = getattr(usage, "completion_tokens", None)
+        span.attributes["total_tokens"] = getattr(usage, "total_tokens", None)
+
+
+class TracedClient(ClientWrapper):
+    """
+    Records every chat and embedding call as an "llm" span with the model,
+    latency and token usage. A streamed chat call stays open until the stream
+    has been read, and takes its usage from the final chunk if the request
+    asked for it (stream_options={"include_usage": True}). If agent is given,
+    calls are attributed to it even outside of an agent span.
+    """
+    def __init__(self, client, tracer, agent=None):
+        super().__init__(client)
+        self.tracer = tracer
+        self.agent = agent
+
+    def _start(self, kind, kwargs):
+        attributes = {"model": kwargs.get("model")}
+        if self.agent is not None:
+            attributes["agent"] = self.agent
+        if kind == "embeddings":
+            inputs = kwargs.get("input")
+            attributes["inputs"] = 1 if isinstance(inputs, str) else len(inputs or ())
+        return self.tracer.start_span(f"{kind}.create", "llm", **attributes)
+
+    def _call(self, kind, create, kwargs):
+        span = self._start(kind, kwargs)
+        try:
+            response = create(**kwargs)
+        except Exception as error:
+            self.tracer.finish_span(span, error)
+            raise
+        if kwargs.get("stream"):
+            return self._traced_stream(span, response)
+        _record_usage(span, response)
+        self.tracer.finish_span(span)
+        return response
+
+    async def _call_async(self, kind, create, kwargs):
+        span = self._start(kind, kwargs)
+        try:
+            response = await create(**kwargs)
+        except Exception as error:
+            self.tracer.finish_span(span, error)
+            raise
+        if kwargs.get("stream"):
+            return self._traced_stream_async(span, response)
+        _record_usage(span, response)
+        self.tracer.finish_span(span)
+        return response
+
+    def _traced_stream(self, span, stream):
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    _record_usage(span, chunk)
+                yield chunk
+        finally:
+            # Also ends the HTTP response if the consumer stopped early.
+            try:
+                stream.close()
+            finally:
+                self.tracer.finish_span(span)
+
+    async def _traced_stream_async(self, span, stream):
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None) is not None:
+                    _record_usage(span, chunk)
+                yield chunk
+        finally:
+            try:
+                # An AsyncStream, or the async generator of another wrapper.
+                await (stream.aclose() if hasattr(stream, "aclose") else stream.close())
+            finally:
+                self.tracer.finish_span(span)
+
+
+def _traced_method(tracer, agent_name, name, method):
+    span_name = f"{agent_name}.{name}"
+
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def traced(*args, **kwargs):
+            span = tracer.start_span(span_name, "agent", agent=agent_name)
+            generator = method(*args, **kwargs)
+            error = None
+            try:
+                while True:
+                    # The span is current only while the method runs, not while
+                    # the caller holds an item, so the caller's own spans are
+                    # not nested under it.
+                    token = _current_span.set(span)
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        _current_span.reset(token)
+                    yield item
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                token = _current_span.set(span)
+                try:
+                    await generator.aclose()
+                finally:
+                    _current_span.reset(token)
+                    tracer.finish_span(span, error)
+    elif inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def traced(*args, **kwargs):
+            with tracer.span(span_name, "agent", agent=agent_name):
+                return await method(*args, **kwargs)
+    elif inspect.isgeneratorfunction(method):
+        @functools.wraps(method)
+        def traced(*args, **kwargs):
+            span = tracer.start_span(span_name, "agent", agent=agent_name)
+            generator = method(*args, **kwargs)
+            error = None
+            try:
+                while True:
+                    # As above: current only while the method runs.
+                    token = _current_span.set(span)
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        return
+                    finally:
+                        _current_span.reset(token)
+                    yield item
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                token = _current_span.set(span)
+                try:
+                    generator.close()
+                finally:
+                    _current_span.reset(token)
+                    tracer.finish_span(span, error)
+    else:
+        @functools.wraps(method)
+        def traced(*args, **kwargs):
+            with tracer.span(span_name, "agent", agent=agent_name):
+                return method(*args, **kwargs)
+    return traced
+
+
+def instrument(agent, tracer, name=None):
+    """
+    Traces an agent in place: its clients are wrapped in TracedClient and its
+    public methods (respond, evaluate, route, ...) open an "agent" span, so the
+    API calls they make are attributed to the agent and nested under the call
+    that caused them. name defaults to the class name. An EvaluationAgent's
+    worker is instrumented too. Returns the agent.
+    """
+    if getattr(agent, "_tracer", None) is tracer:
+        return agent
+    name = name or type(agent).__name__
+    agent._tracer = tracer
+    for attribute in ("client", "async_client"):
+        client = getattr(agent, attribute, None)
+        if client is not None:
+            setattr(agent, attribute, TracedClient(client, tracer, agent=name))
+    for method_name in TRACED_METHODS:
+        method = getattr(agent, method_name, None)
+        if method is not None:
+            setattr(agent, method_name, _traced_method(tracer, name, method_name, method))
+    worker = getattr(agent, "agent_to_evaluate", None)
+    if worker is not None:
+        instrument(worker, tracer)
+    return agent
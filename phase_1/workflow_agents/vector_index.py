@@ -0,0 +1,432 @@
+import numpy as np
+
+# Vectors are assigned to clusters in blocks of this many rows, which bounds the
+# size of the temporary score matrices during training and ingestion.
+_ASSIGN_BLOCK = 8192
+# Storage precisions of FlatIndex. bfloat16 (the upper half of each float32)
+# halves the memory of float32 and int8 (one byte per dimension plus a float32
+# scale per vector) quarters it. bfloat16 rather than IEEE float16: NumPy
+# converts float16 to float32 an order of magnitude slower than a float32
+# scan, while a bfloat16 upcast is a single shift.
+PRECISIONS = ("float32", "bfloat16", "int8")
+# Quantized vectors are converted back to float32 for scoring this many values
+# at a time (1 MB), so a search never holds a float32 copy of the whole index
+# and each converted block is still in cache when it is multiplied.
+_DEQUANTIZE_BLOCK = 1 << 18
+
+
+def _top_k(scores, k):
+    """Column indices of the k highest scores in each row of a 2-D array, best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.intp)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def _as_queries(queries):
+    """Returns the queries as a float32 2-D array and whether a single vector was given."""
+    queries = np.asarray(queries, dtype=np.float32)
+    return np.atleast_2d(queries), queries.ndim == 1
+
+
+def _unpack(scores, ids, single):
+    return (scores[0], ids[0]) if single else (scores, ids)
+
+
+def quantize(vectors, precision):
+    """
+    Converts float32 vectors to a storage precision. Returns (codes, scales):
+    bfloat16 codes are the rounded upper 16 bits of each float32, as uint16;
+    for int8 every vector is scaled so its largest coordinate maps to 127 and
+    scales holds the float32 factor back; otherwise scales is None.
+    """
+    vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+    if precision == "float32":
+        return vectors, None
+    if precision == "bfloat16":
+        bits = vectors.view(np.uint32)
+        # Round to nearest, ties to even, before dropping the low half.
+        return ((bits + (0x7FFF + ((bits >> 16) & 1))) >> 16).astype(np.uint16), None
+    if precision == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown precision '{precision}'; expected one of {', '.join(PRECISIONS)}.")
+
+
+def _upcast(codes, out):
+    """Writes codes from quantize() to a float32 array of the same shape, without their scales."""
+    if codes.dtype == np.uint16:
+        np.left_shift(codes, 16, out=out.view(np.uint32), dtype=np.uint32)
+    else:
+        np.copyto(out, codes)
+    return out
+
+
+def dequantize(codes, scales=None):
+    """float32 vectors from codes and scales made by quantize()."""
+    if codes.dtype == np.float32:
+        return codes
+    vectors = _upcast(codes, np.empty(codes.shape, dtype=np.float32))
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+
+def quantized_scores(queries, codes, scales=None):
+    """
+    Inner products of float32 queries (a 2-D array) with vectors stored by
+    quantize(), as one row of scores per query. Quantized codes are upcast
+    block by block into one reused float32 buffer.
+    """
+    if codes.dtype == np.float32:
+        return queries @ codes.T
+    scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+    step = max(_DEQUANTIZE_BLOCK // max(codes.shape[1], 1), 1)
+    buffer = np.empty((min(step, len(codes)), codes.shape[1]), dtype=np.float32)
+    for start in range(0, len(codes), step):
+        block = codes[start:start + step]
+        scores[:, start:start + len(block)] = queries @ _upcast(block, buffer[:len(block)]).T
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def _nearest(vectors, centroids, metric):
+    """Index of the best centroid for every vector, computed block by block."""
+    assignments = np.empty(len(vectors), dtype=np.intp)
+    if metric == "l2":
+        centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK):
+        block = vectors[start:start + _ASSIGN_BLOCK]
+        scores = block @ centroids.T
+        if metric == "l2":
+            # argmin ||x - c||^2 == argmax (2 x.c - ||c||^2)
+            scores *= 2
+            scores -= centroid_norms
+        assignments[start:start + len(block)] = np.argmax(scores, axis=1)
+    return assignments
+
+
+def kmeans(vectors, n_clusters, iterations=20, metric="ip", seed=0):
+    """
+    Plain NumPy k-means. With metric="ip" the centroids are kept at unit length
+    (spherical k-means, suited to cosine similarity); with metric="l2" it is the
+    usual Euclidean k-means. Empty clusters are re-seeded from random vectors.
+    """
+    rng = np.random.default_rng(seed)
+    # Sub-vector slices are strided views; a contiguous copy keeps the matmuls on BLAS.
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _nearest(vectors, centroids, metric)
+        # Sum the members of each cluster by sorting once and reducing each run.
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_clusters)
+        present = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[present] = np.add.reduceat(vectors[order], np.cumsum(counts)[present] - counts[present])
+        empty = counts == 0
+        counts[empty] = 1
+        centroids = sums / counts[:, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        if metric == "ip":
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+    return centroids.astype(np.float32)
+
+
+class FlatIndex:
+    """
+    An exact index: every query is scored against every stored vector with one
+    matrix product. Vectors are expected to be unit length, so the inner product
+    is the cosine similarity.
+
+    precision is how the vectors are stored: "float32", "bfloat16" or "int8"
+    (see quantize()). The lower precisions trade a little accuracy in the
+    scores for two or four times less memory.
+    """
+    def __init__(self, precision="float32"):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}'; expected one of {', '.join(PRECISIONS)}.")
+        self.precision = precision
+        self._vectors = None
+        self._scales = np.empty(0, dtype=np.float32)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._next_id = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        """The stored vectors as a float32 matrix, in insertion order (a copy unless stored as float32)."""
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return dequantize(self._vectors[:self._size], self.scales if self.precision == "int8" else None)
+
+    @property
+    def scales(self):
+        """The int8 scale of every stored vector (empty for the float precisions)."""
+        return self._scales[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    def add(self, vectors, ids=None):
+        """
+        Appends vectors to the index. ids default to consecutive integers
+        following the largest id added so far. Returns the ids of the added vectors.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + len(vectors), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(vectors) == 0:
+            return ids
+        codes, scales = quantize(vectors, self.precision)
+        needed = self._size + len(vectors)
+        if self._vectors is None:
+            self._vectors = np.empty((needed, vectors.shape[1]), dtype=codes.dtype)
+        elif needed > len(self._vectors):
+            # Grow geometrically so a stream of small adds stays amortized O(1).
+            grown = np.empty((max(needed, 2 * len(self._vectors)), self._vectors.shape[1]), dtype=codes.dtype)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        if len(self._ids) < len(self._vectors):
+            grown_ids = np.empty(len(self._vectors), dtype=np.int64)
+            grown_ids[:self._size] = self._ids[:self._size]
+            self._ids = grown_ids
+        if scales is not None and len(self._scales) < len(self._vectors):
+            grown_scales = np.empty(len(self._vectors), dtype=np.float32)
+            grown_scales[:self._size] = self._scales[:self._size]
+            self._scales = grown_scales
+        self._vectors[self._size:needed] = codes
+        if scales is not None:
+            self._scales[self._size:needed] = scales
+        self._ids[self._size:needed] = ids
+        self._size = needed
+        self._next_id = max(self._next_id, int(ids.max()) + 1)
+        return ids
+
+    def remove(self, ids):
+        """
+        Removes the vectors with the given ids, compacting the buffer in place.
+        Returns the number of vectors removed.
+        """
+        keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+        kept = int(keep.sum())
+        removed = self._size - kept
+        if removed:
+            self._vectors[:kept] = self._vectors[:self._size][keep]
+            if self.precision == "int8":
+                self._scales[:kept] = self.scales[keep]
+            self._ids[:kept] = self.ids[keep]
+            self._size = kept
+        return removed
+
+    def search(self, queries, k):
+        """
+        Returns (scores, ids) of the k most similar vectors for each query, best
+        first. A single query vector gives 1-D results, a matrix of queries 2-D.
+        """
+        queries, single = _as_queries(queries)
+        if self._size == 0:
+            empty = np.empty((len(queries), 0))
+            return _unpack(empty.astype(np.float32), empty.astype(np.int64), single)
+        scores = quantized_scores(queries, self._vectors[:self._size],
+                                  self.scales if self.precision == "int8" else None)
+        top = _top_k(scores, k)
+        return _unpack(np.take_along_axis(scores, top, axis=1), self.ids[top], single)
+
+    def nbytes(self):
+        """Memory held by the stored vectors, their scales and ids."""
+        vectors = 0 if self._vectors is None else self._vectors[:self._size].nbytes
+        return vectors + self.scales.nbytes + self.ids.nbytes
+
+
+class IVFIndex:
+    """
+    An approximate inverted-file index. A k-means coarse quantizer splits the
+    vectors into n_lists clusters and a query only scans the n_probe clusters
+    whose centroids are closest to it, trading recall for speed.
+
+    With pq_subvectors set, the residuals (vector minus its centroid) are stored
+    as product-quantization codes instead of float32 vectors: each vector is cut
+    into pq_subvectors pieces and each piece is replaced by the id of its nearest
+    codeword (pq_bits bits). Scores are then looked up from per-query tables, so
+    memory per vector drops from 4 * dim bytes to pq_subvectors bytes.
+
+    Recall/latency knobs: n_lists, n_probe (can be changed after building),
+    pq_subvectors and pq_bits.
+    """
+    def __init__(self, n_lists=256, n_probe=8, pq_subvectors=None, pq_bits=8,
+                 train_iterations=20, max_train_size=50_000, seed=0):
+        if pq_subvectors is not None and not 1 <= pq_bits <= 8:
+            raise ValueError("pq_bits must be between 1 and 8.")
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.pq_subvectors = pq_subvectors
+        self.pq_bits = pq_bits
+        self.train_iterations = train_iterations
+        self.max_train_size = max_train_size
+        self.seed = seed
+        self.centroids = None
+        self.codebooks = None
+        self._list_ids = []
+        self._list_data = []
+        self._size = 0
+        self._next_id = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def train(self, vectors):
+        """
+        Learns the coarse centroids (and the PQ codebooks, if enabled) from a
+        representative sample of vectors.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.max_train_size:
+            vectors = vectors[rng.choice(len(vectors), self.max_train_size, replace=False)]
+        self.centroids = kmeans(vectors, self.n_lists, self.train_iterations, metric="ip", seed=self.seed)
+        n_lists = len(self.centroids)
+        self._list_ids = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self._list_data = [None] * n_lists
+
+        if self.pq_subvectors is not None:
+            dim = vectors.shape[1]
+            if dim % self.pq_subvectors:
+                raise ValueError(f"Dimension {dim} is not divisible by pq_subvectors={self.pq_subvectors}.")
+            # About 64 training points per codeword are plenty for the codebooks.
+            sample = vectors[rng.permutation(len(vectors))[:64 * 2 ** self.pq_bits]]
+            residuals = sample - self.centroids[_nearest(sample, self.centroids, "ip")]
+            sub_dim = dim // self.pq_subvectors
+            self.codebooks = np.stack([
+                kmeans(residuals[:, m * sub_dim:(m + 1) * sub_dim], 2 ** self.pq_bits,
+                       self.train_iterations, metric="l2", seed=self.seed + m)
+                for m in range(self.pq_subvectors)
+            ])
+
+    def _encode(self, residuals):
+        """Product-quantization codes (one uint8 per sub-vector) of the residuals."""
+        sub_dim = residuals.shape[1] // self.pq_subvectors
+        codes = np.empty((len(residuals), self.pq_subvectors), dtype=np.uint8)
+        for m, codebook in enumerate(self.codebooks):
+            piece = np.ascontiguousarray(residuals[:, m * sub_dim:(m + 1) * sub_dim])
+            codes[:, m] = _nearest(piece, codebook, "l2")
+        return codes
+
+    def add(self, vectors, ids=None):
+        """
+        Adds vectors to their nearest clusters. If the index is untrained it is
+        first trained on these vectors, so when vectors arrive in small batches
+        call train() on a representative sample beforehand. Returns the ids of
+        the added vectors.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + len(vectors), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(vectors) == 0:
+            return ids
+        if not self.is_trained:
+            self.train(vectors)
+        assignments = _nearest(vectors, self.centroids, "ip")
+        if self.codebooks is not None:
+            data = self._encode(vectors - self.centroids[assignments])
+        else:
+            data = vectors
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        for cluster in np.unique(assignments):
+            rows = order[bounds[cluster]:bounds[cluster + 1]]
+            self._list_ids[cluster] = np.concatenate([self._list_ids[cluster], ids[rows]])
+            if self._list_data[cluster] is None:
+                self._list_data[cluster] = data[rows]
+            else:
+                self._list_data[cluster] = np.concatenate([self._list_data[cluster], data[rows]])
+        self._size += len(vectors)
+        self._next_id = max(self._next_id, int(ids.max()) + 1)
+        return ids
+
+    def remove(self, ids):
+        """
+        Removes the vectors with the given ids from their clusters. The trained
+        centroids and codebooks are kept. Returns the number of vectors removed.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        removed = 0
+        for cluster, list_ids in enumerate(self._list_ids):
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                removed += len(keep) - int(keep.sum())
+                self._list_ids[cluster] = list_ids[keep]
+                self._list_data[cluster] = self._list_data[cluster][keep]
+        self._size -= removed
+        return removed
+
+    def search(self, queries, k, n_probe=None):
+        """
+        Returns approximate (scores, ids) of the k most similar vectors for each
+        query, best first. n_probe overrides the index default for this call.
+        Queries whose probed clusters hold fewer than k vectors get id -1 and
+        score -inf in the unused slots.
+        """
+        queries, single = _as_queries(queries)
+        scores_out = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        ids_out = np.full((len(queries), k), -1, dtype=np.int64)
+        if not self.is_trained or self._size == 0:
+            return _unpack(scores_out, ids_out, single)
+
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        coarse = queries @ self.centroids.T
+        probes = _top_k(coarse, n_probe)
+        if self.codebooks is not None:
+            sub_dim = queries.shape[1] // self.pq_subvectors
+            # tables[q, m, c]: inner product of query q's m-th piece with codeword c.
+            tables = np.einsum("qmd,mcd->qmc",
+                               queries.reshape(len(queries), self.pq_subvectors, sub_dim), self.codebooks)
+        subvector_index = np.arange(self.pq_subvectors or 0)
+
+        for q in range(len(queries)):
+            candidate_scores, candidate_ids = [], []
+            for cluster in probes[q]:
+                data = self._list_data[cluster]
+                if data is None or len(data) == 0:
+                    continue
+                if self.codebooks is not None:
+                    scores = coarse[q, cluster] + tables[q, subvector_index, data].sum(axis=1)
+                else:
+                    scores = data @ queries[q]
+                candidate_scores.append(scores)
+                candidate_ids.append(self._list_ids[cluster])
+            if not candidate_scores:
+                continue
+            scores = np.concatenate(candidate_scores)[None, :]
+            top = _top_k(scores, k)[0]
+            scores_out[q, :len(top)] = scores[0, top]
+            ids_out[q, :len(top)] = np.concatenate(candidate_ids)[top]
+        return _unpack(scores_out, ids_out, single)
+
+    def nbytes(self):
+        """Memory held by the centroids, codebooks, stored vectors or codes, and ids."""
+        total = 0 if self.centroids is None else self.centroids.nbytes
+        total += 0 if self.codebooks is None else self.codebooks.nbytes
+        total += sum(data.nbytes for data in self._list_data if data is not None)
+        return total + sum(ids.nbytes for ids in self._list_ids)
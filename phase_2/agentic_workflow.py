@@ -1,4 +1,6 @@
+import contextlib
 import os
+import sys
 # from dotenv import load_dotenv
 
 # TODO 1: Import all the agent classes from base_agents
@@ -6,35 +8,82 @@ from base_agents import (
     ActionPlanningAgent,
     KnowledgeAugmentedPromptAgent,
     EvaluationAgent,
-    RoutingAgent
+    RoutingAgent,
+    RoutingCache,
+    get_client
 )
+from workflow_graph import run_step_graph
 
-# --- Main Orchestration Script ---
-def main():
-    """
-    Main function to orchestrate the agentic workflow.
-    """
-    # TODO 2: Load your OpenAI API key from environment variables
-    # load_dotenv()
-    # openai_api_key = os.getenv("OPENAI_API_KEY")
-    # if not openai_api_key:
-    #     print("Error: OPENAI_API_KEY not found.")
-    #     return
+# The caches live in the phase_1 workflow_agents package.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase_1"))
+from workflow_agents.embedding_cache import EmbeddingCache
+from workflow_agents.metrics import RoutingMetrics
+from workflow_agents.response_cache import ResponseCache
+from workflow_agents.scheduler import Scheduler
+from workflow_agents.tracing import Tracer, instrument
 
-    base_url = "https://openai.vocareum.com/v1"
-    api_key = "voc-00000000000000000000000000000000abcd.12345678"
+# Maximum number of workflow steps processed at the same time.
+MAX_PARALLEL_STEPS = 4
 
-    # TODO 3: Load the content of the Product-Spec-Email-Router.txt document
-    try:
-        with open('Product-Spec-Email-Router.txt', 'r') as f:
-            product_spec = f.read()
-    except FileNotFoundError:
-        print("Error: Product-Spec-Email-Router.txt not found.")
-        print("Please create this file and add your product specifications.")
-        return
+# Set WORKFLOW_RESPONSE_CACHE to a directory to keep model responses and
+# embeddings on disk, so re-running a workflow with the same spec replays them
+# instead of calling the API. Only deterministic (temperature 0) responses are
+# cached unless WORKFLOW_CACHE_ALL_RESPONSES=1 is also set.
+RESPONSE_CACHE_DIR = os.getenv("WORKFLOW_RESPONSE_CACHE")
+CACHE_ALL_RESPONSES = os.getenv("WORKFLOW_CACHE_ALL_RESPONSES") == "1"
+
+# Every API call goes through one scheduler, which retries rate limits and
+# transient errors. WORKFLOW_RPM and WORKFLOW_TPM cap the requests and tokens
+# per minute sent to each model (unlimited if unset).
+RATE_LIMITS = {
+    limit: int(os.environ[variable])
+    for limit, variable in (("rpm", "WORKFLOW_RPM"), ("tpm", "WORKFLOW_TPM"))
+    if os.getenv(variable)
+}
+
+# Set WORKFLOW_TRACE to a file name to record every agent call and API request
+# (latency, model, tokens) as a span tree, printed at the end and saved as JSON.
+TRACE_PATH = os.getenv("WORKFLOW_TRACE")
+
+def trace_span(tracer, name, **attributes):
+    """A tracing span if tracing is enabled, otherwise a no-op context manager."""
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, **attributes)
+
+# --- Starter Prompts and Knowledge (as provided in starter code) ---
+DEFAULT_PRODUCT_NAME = "Email Router"
+WORKFLOW_PROMPT = "Generate a comprehensive project plan for the {product} product, including user stories, features, and engineering tasks."
 
-    # --- Starter Prompts and Knowledge (as provided in starter code) ---
-    workflow_prompt = "Generate a comprehensive project plan for the Email Router product, including user stories, features, and engineering tasks."
+def create_clients(base_url, api_key):
+    """
+    Creates the client shared by every agent, and the scheduler and caches
+    behind it. Returns (client, scheduler, response_cache, embedding_cache);
+    the caches are None unless WORKFLOW_RESPONSE_CACHE is set.
+    """
+    # One client for every agent: calls are scheduled under the rate limits,
+    # behind the response cache if it is enabled (cache hits are not limited)
+    scheduler = Scheduler(default_limits=RATE_LIMITS)
+    client = scheduler.wrap(get_client(base_url, api_key))
+    response_cache = None
+    embedding_cache = None
+    if RESPONSE_CACHE_DIR:
+        response_cache = ResponseCache(
+            directory=os.path.join(RESPONSE_CACHE_DIR, "responses"),
+            cache_nondeterministic=CACHE_ALL_RESPONSES
+        )
+        client = response_cache.wrap(client)
+        embedding_cache = EmbeddingCache(os.path.join(RESPONSE_CACHE_DIR, "embeddings"))
+    return client, scheduler, response_cache, embedding_cache
+
+def build_agents(product_spec, base_url, api_key, client, product_name=DEFAULT_PRODUCT_NAME,
+                 embedding_cache=None, tracer=None, metrics=None):
+    """
+    Instantiates the agent teams for one product specification. Returns the
+    action planning agent and the routing agent, whose agents run the
+    knowledge and evaluation agents of each team. Routing decisions are
+    recorded in metrics, a RoutingMetrics, if given.
+    """
     knowledge_action_planning = "The project plan should be broken down into three main phases: 1. Define user stories. 2. Define product features. 3. Define engineering tasks for implementation."
     
     # Personas
@@ -49,8 +98,8 @@ def main():
     
     # Knowledge (partially provided, completed in TODO 5)
     knowledge_product_manager = "Base your user stories on the following product specification: "
-    knowledge_program_manager = "You are defining features for an Email Router. Base your features on the user stories provided."
-    knowledge_dev_engineer = "You are defining engineering tasks for an Email Router. Base your tasks on the features provided."
+    knowledge_program_manager = f"You are defining features for an {product_name}. Base your features on the user stories provided."
+    knowledge_dev_engineer = f"You are defining engineering tasks for an {product_name}. Base your tasks on the features provided."
     
     # --- Agent Instantiation ---
 
@@ -58,6 +107,7 @@ def main():
     action_planning_agent = ActionPlanningAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         knowledge=knowledge_action_planning
     )
 
@@ -69,8 +119,10 @@ def main():
     product_manager_knowledge_agent = KnowledgeAugmentedPromptAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         persona=persona_product_manager,
-        knowledge=knowledge_product_manager
+        knowledge=knowledge_product_manager,
+        embedding_cache=embedding_cache
     )
 
     # TODO 7: Instantiate the Product Manager's Evaluation Agent
@@ -78,6 +130,7 @@ def main():
     product_manager_evaluation_agent = EvaluationAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         persona=persona_product_manager_eval,
         evaluation_criteria=pm_evaluation_criteria,
         agent_to_evaluate=product_manager_knowledge_agent
@@ -88,8 +141,10 @@ def main():
     program_manager_knowledge_agent = KnowledgeAugmentedPromptAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         persona=persona_program_manager,
-        knowledge=knowledge_program_manager
+        knowledge=knowledge_program_manager,
+        embedding_cache=embedding_cache
     )
 
     # TODO 8: Instantiate the Program Manager's Evaluation Agent
@@ -103,6 +158,7 @@ def main():
     program_manager_evaluation_agent = EvaluationAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         persona=persona_program_manager_eval,
         evaluation_criteria=prog_m_evaluation_criteria,
         agent_to_evaluate=program_manager_knowledge_agent
@@ -113,8 +169,10 @@ def main():
     dev_engineer_knowledge_agent = KnowledgeAugmentedPromptAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         persona=persona_dev_engineer,
-        knowledge=knowledge_dev_engineer
+        knowledge=knowledge_dev_engineer,
+        embedding_cache=embedding_cache
     )
 
     # TODO 9: Instantiate the Development Engineer's Evaluation Agent
@@ -131,6 +189,7 @@ def main():
     dev_engineer_evaluation_agent = EvaluationAgent(
         base_url = base_url, 
         openai_api_key= api_key,
+        client=client,
         persona=persona_dev_engineer_eval,
         evaluation_criteria=dev_eng_evaluation_criteria,
         agent_to_evaluate=dev_engineer_knowledge_agent
@@ -151,7 +210,27 @@ def main():
 
     # --- Routing Agent (TODO 10) ---
     routing_agent = RoutingAgent(base_url = base_url, 
-                                 openai_api_key= api_key)
+                                 openai_api_key= api_key,
+                                 embedding_cache=embedding_cache,
+                                 routing_cache=RoutingCache(),
+                                 metrics=metrics,
+                                 client=client)
+
+    # Trace every agent under a readable name. Workers go first, so their
+    # evaluation agents keep the names given here.
+    if tracer is not None:
+        for name, agent in [
+            ("Action Planning", action_planning_agent),
+            ("Product Manager", product_manager_knowledge_agent),
+            ("Product Manager Evaluation", product_manager_evaluation_agent),
+            ("Program Manager", program_manager_knowledge_agent),
+            ("Program Manager Evaluation", program_manager_evaluation_agent),
+            ("Development Engineer", dev_engineer_knowledge_agent),
+            ("Development Engineer Evaluation", dev_engineer_evaluation_agent),
+            ("Routing", routing_agent),
+        ]:
+            instrument(agent, tracer, name=name)
+
     routing_agent.agents = [
         {
             "name": "Product Manager",
@@ -169,37 +248,109 @@ def main():
             "func": development_engineer_support_function
         }
     ]
+    return action_planning_agent, routing_agent
+
+def run_workflow(action_planning_agent, routing_agent, workflow_prompt, tracer=None,
+                 max_parallel_steps=MAX_PARALLEL_STEPS, verbose=True):
+    """
+    Plans the workflow for a prompt, then routes and runs its steps. Returns a
+    dict with the planned 'steps', their 'results' in plan order and the
+    'final_output'. verbose prints the steps as they are processed.
+    """
+    log = print if verbose else (lambda *args: None)
+
+    def process_step(step, dependency_results):
+        log(f"\n--- Processing Step: {step['step']} ---")
+
+        with trace_span(tracer, f"Step {step['id']}", step=step['step']):
+            # The step text alone decides the route; the results of the steps it
+            # depends on are handed to the chosen agent as context.
+            agent = routing_agent.select_agent(step['step'])
+            if agent is None:
+                return "No suitable agent found for the prompt."
+            prompt = step['step']
+            if dependency_results:
+                context = "\n\n".join(dependency_results[dependency] for dependency in step['depends_on'])
+                prompt += f"\n\nBase your answer on the results of the previous steps:\n{context}"
+            result = agent['func'](prompt)
+
+        # Print the result of the current step
+        log(f"\n--- Result of Step: {step['step']} ({agent['name']}) ---\n{result}\n" + "-" * 25)
+        return result
+
+    with trace_span(tracer, "Workflow"):
+        # Get the workflow steps, and which steps each one needs the results of,
+        # from the Action Planning Agent
+        workflow_steps = action_planning_agent.extract_step_graph_from_prompt(workflow_prompt)
+
+        # Independent steps run in parallel; each step starts as soon as the steps
+        # it depends on are done.
+        results = run_step_graph(workflow_steps, process_step, max_workers=max_parallel_steps)
+
+    # Collect the completed steps in plan order
+    completed_steps = [results[step['id']] for step in workflow_steps]
+    final_output = completed_steps[-1] if completed_steps else "No output generated."
+    return {"steps": workflow_steps, "results": completed_steps, "final_output": final_output}
+
+# --- Main Orchestration Script ---
+def main():
+    """
+    Main function to orchestrate the agentic workflow.
+    """
+    # TODO 2: Load your OpenAI API key from environment variables
+    # load_dotenv()
+    # openai_api_key = os.getenv("OPENAI_API_KEY")
+    # if not openai_api_key:
+    #     print("Error: OPENAI_API_KEY not found.")
+    #     return
+
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
+    api_key = "voc-00000000000000000000000000000000abcd.12345678"
+
+    # TODO 3: Load the content of the Product-Spec-Email-Router.txt document
+    try:
+        with open('Product-Spec-Email-Router.txt', 'r') as f:
+            product_spec = f.read()
+    except FileNotFoundError:
+        print("Error: Product-Spec-Email-Router.txt not found.")
+        print("Please create this file and add your product specifications.")
+        return
+
+    client, scheduler, response_cache, embedding_cache = create_clients(base_url, api_key)
+    tracer = Tracer() if TRACE_PATH else None
+    metrics = RoutingMetrics()
+    action_planning_agent, routing_agent = build_agents(
+        product_spec, base_url, api_key, client, embedding_cache=embedding_cache, tracer=tracer, metrics=metrics
+    )
 
     # --- Workflow Execution (TODO 12) ---
     print("--- Starting Agentic Workflow for Project Plan Generation ---")
-    
-    # Get the list of workflow steps from the Action Planning Agent
-    workflow_steps = action_planning_agent.extract_steps_from_prompt(workflow_prompt)
-    
-    # Initialize an empty list for completed steps
-    completed_steps = []
-    
-    # Iterate through the workflow steps
-    for i, step in enumerate(workflow_steps):
-        print(f"\n--- Processing Step: {step} ---")
-        
-        # Use the routing agent to invoke the appropriate support function
-        result = routing_agent.route(step)
-        
-        # Append the result to the completed_steps list
-        completed_steps.append(result)
-        
-        # Print the result of the current step
-        print("\n--- Result of Step ---")
-        print(result)
-        print("-" * 25)
+    workflow = run_workflow(action_planning_agent, routing_agent,
+                            WORKFLOW_PROMPT.format(product=DEFAULT_PRODUCT_NAME), tracer=tracer)
 
     # After processing all steps, print the final output
     print("\n\n--- Final Output of the Workflow ---")
-    final_output = completed_steps[-1] if completed_steps else "No output generated."
-    print(final_output)
+    print(workflow["final_output"])
     print("--- Workflow Complete ---")
 
+    print(f"Scheduler: {scheduler.stats()}")
+    print(f"Routing cache: {routing_agent.routing_cache.stats()}")
+    routing = metrics.snapshot()
+    print(f"Routing: {routing['teams']} by {routing['sources']}, "
+          + ", ".join(f"{source} {1000 * latency['mean']:.1f} ms mean" for source, latency in routing['latency'].items()))
+    if response_cache is not None:
+        print(f"Response cache: {response_cache.stats()}")
+        embedding_cache.close()
+
+    if tracer is not None:
+        print("\n--- Trace ---")
+        print(tracer.format_tree())
+        for name, totals in tracer.summary().items():
+            print(f"{name}: {totals['calls']} calls, {totals['seconds']:.2f} s, "
+                  f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens")
+        tracer.export(TRACE_PATH)
+        print(f"Trace written to {TRACE_PATH}")
+
 
 if __name__ == '__main__':
     main()
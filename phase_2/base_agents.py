@@ -1,8 +1,19 @@
+import asyncio
+import contextvars
+import importlib.util
+import inspect
+import json
 import os
-from openai import OpenAI
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 import numpy as np
 
-# Helper function for cosine similarity, used by the RoutingAgent
+# Helper function for cosine similarity
 def cosine_similarity(v1, v2):
     """Calculates the cosine similarity between two vectors."""
     dot_product = np.dot(v1, v2)
@@ -10,6 +21,381 @@ def cosine_similarity(v1, v2):
     norm_v2 = np.linalg.norm(v2)
     return dot_product / (norm_v1 * norm_v2)
 
+def normalize_rows(matrix):
+    """
+    Scales each row of a matrix (or a single vector) to unit length.
+    Rows with zero norm are left as zeros.
+    """
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the k highest scores, best first. Uses argpartition so
+    only the k winners are sorted rather than the whole score vector.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+# Embedding quantization, copied from workflow_agents.vector_index so this
+# module stays standalone. Keep the two copies identical.
+PRECISIONS = ("float32", "bfloat16", "int8")
+_DEQUANTIZE_BLOCK = 1 << 18
+
+def quantize(vectors, precision):
+    """
+    Converts float32 vectors to a storage precision. Returns (codes, scales):
+    bfloat16 codes are the rounded upper 16 bits of each float32, as uint16;
+    for int8 every vector is scaled so its largest coordinate maps to 127 and
+    scales holds the float32 factor back; otherwise scales is None.
+    """
+    vectors = np.ascontiguousarray(np.atleast_2d(vectors), dtype=np.float32)
+    if precision == "float32":
+        return vectors, None
+    if precision == "bfloat16":
+        bits = vectors.view(np.uint32)
+        # Round to nearest, ties to even, before dropping the low half.
+        return ((bits + (0x7FFF + ((bits >> 16) & 1))) >> 16).astype(np.uint16), None
+    if precision == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.rint(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Unknown precision '{precision}'; expected one of {', '.join(PRECISIONS)}.")
+
+def _upcast(codes, out):
+    """Writes codes from quantize() to a float32 array of the same shape, without their scales."""
+    if codes.dtype == np.uint16:
+        np.left_shift(codes, 16, out=out.view(np.uint32), dtype=np.uint32)
+    else:
+        np.copyto(out, codes)
+    return out
+
+def dequantize(codes, scales=None):
+    """float32 vectors from codes and scales made by quantize()."""
+    if codes.dtype == np.float32:
+        return codes
+    vectors = _upcast(codes, np.empty(codes.shape, dtype=np.float32))
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+def quantized_scores(queries, codes, scales=None):
+    """
+    Inner products of float32 queries (a 2-D array) with vectors stored by
+    quantize(), as one row of scores per query. Quantized codes are upcast
+    block by block into one reused float32 buffer.
+    """
+    if codes.dtype == np.float32:
+        return queries @ codes.T
+    scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+    step = max(_DEQUANTIZE_BLOCK // max(codes.shape[1], 1), 1)
+    buffer = np.empty((min(step, len(codes)), codes.shape[1]), dtype=np.float32)
+    for start in range(0, len(codes), step):
+        block = codes[start:start + step]
+        scores[:, start:start + len(block)] = queries @ _upcast(block, buffer[:len(block)]).T
+    if scales is not None:
+        scores *= scales
+    return scores
+
+# Limits for batched embedding requests. The embeddings endpoint accepts a list
+# of inputs per request; batches are capped both by item count and by an
+# estimate of their total token count.
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_BATCH_TOKENS = 200_000
+EMBEDDING_CONCURRENCY = 4
+
+def estimate_tokens(text):
+    """Roughly estimates the number of tokens in a text (about four characters per token)."""
+    return len(text) // 4 + 1
+
+# Default chunk size and overlap, in estimated tokens, for splitting documents.
+CHUNK_TOKENS = 500
+CHUNK_OVERLAP_TOKENS = 50
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Splits a text into chunks of at most about max_tokens tokens, cutting only
+    between words. Consecutive chunks share about overlap_tokens tokens so that
+    a passage cut at a boundary still appears whole in one chunk. Chunks are
+    slices of the original text and are yielded lazily.
+    """
+    window = deque()  # (start, end, tokens) of the words in the current chunk
+    window_tokens = 0
+    for match in re.finditer(r"\S+", text):
+        tokens = estimate_tokens(match.group())
+        if window and window_tokens + tokens > max_tokens:
+            yield text[window[0][0]:window[-1][1]]
+            # Keep the trailing words that fit in the overlap for the next chunk.
+            while window and (window_tokens > overlap_tokens or window_tokens + tokens > max_tokens):
+                window_tokens -= window.popleft()[2]
+        window.append((match.start(), match.end(), tokens))
+        window_tokens += tokens
+    if window:
+        yield text[window[0][0]:window[-1][1]]
+
+def _embedding_batches(texts, batch_size, max_batch_tokens):
+    """
+    Splits texts into consecutive batches bounded by item count and estimated tokens.
+    """
+    batch, batch_tokens = [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_batch_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _embedding_options(model, dimensions):
+    """
+    The cache model name and extra request arguments for embeddings shortened
+    to the given number of dimensions (None for the model's full length).
+    """
+    if dimensions is None:
+        return model, {}
+    return f"{model}@{dimensions}", {"dimensions": dimensions}
+
+def _embedding_matrix(response):
+    """Converts an embeddings response into a float32 matrix in input order."""
+    embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+    return np.asarray(embeddings, dtype=np.float32)
+
+def embed_texts(client, texts, model, batch_size=EMBEDDING_BATCH_SIZE,
+                max_batch_tokens=EMBEDDING_BATCH_TOKENS, max_workers=EMBEDDING_CONCURRENCY,
+                cache=None, dimensions=None):
+    """
+    Embeds a list of texts with as few requests as possible and returns a float32
+    matrix with one row per text, in input order. Up to max_workers batches are
+    sent concurrently. If an embedding cache is given, only the texts it does
+    not already hold are sent, and their vectors are added to it. dimensions
+    asks the model for shortened vectors (text-embedding-3 models only).
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    cache_model, options = _embedding_options(model, dimensions)
+    if cache is not None:
+        cached = cache.get_many(cache_model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            fresh = embed_texts(client, [texts[i] for i in missing], model, batch_size=batch_size,
+                                max_batch_tokens=max_batch_tokens, max_workers=max_workers, dimensions=dimensions)
+            _fill_cached(cache, cache_model, texts, cached, missing, fresh)
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    def embed_batch(batch):
+        return _embedding_matrix(client.embeddings.create(input=batch, model=model, **options))
+
+    batches = list(_embedding_batches(texts, batch_size, max_batch_tokens))
+    if len(batches) == 1 or max_workers <= 1:
+        return np.concatenate([embed_batch(batch) for batch in batches])
+    # pool.map keeps the batches in order, so rows line up with the input texts.
+    # Each batch runs in a copy of the caller's context, so context variables
+    # such as the current tracing span carry over to the worker threads.
+    contexts = [contextvars.copy_context() for _ in batches]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+        return np.concatenate(list(pool.map(lambda context, batch: context.run(embed_batch, batch),
+                                            contexts, batches)))
+
+async def embed_texts_async(async_client, texts, model, batch_size=EMBEDDING_BATCH_SIZE,
+                            max_batch_tokens=EMBEDDING_BATCH_TOKENS, max_workers=EMBEDDING_CONCURRENCY,
+                            cache=None, dimensions=None):
+    """
+    Coroutine version of embed_texts(): up to max_workers batches are in flight
+    at once on the event loop instead of in threads.
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    cache_model, options = _embedding_options(model, dimensions)
+    if cache is not None:
+        cached = cache.get_many(cache_model, texts)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            fresh = await embed_texts_async(async_client, [texts[i] for i in missing], model, batch_size=batch_size,
+                                            max_batch_tokens=max_batch_tokens, max_workers=max_workers,
+                                            dimensions=dimensions)
+            _fill_cached(cache, cache_model, texts, cached, missing, fresh)
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    semaphore = asyncio.Semaphore(max(max_workers, 1))
+
+    async def embed_batch(batch):
+        async with semaphore:
+            return _embedding_matrix(await async_client.embeddings.create(input=batch, model=model, **options))
+
+    batches = list(_embedding_batches(texts, batch_size, max_batch_tokens))
+    return np.concatenate(await asyncio.gather(*(embed_batch(batch) for batch in batches)))
+
+def _fill_cached(cache, model, texts, cached, missing, fresh):
+    """Stores freshly embedded texts in the cache and fills their slots in the lookup result."""
+    cache.put_many(model, [texts[i] for i in missing], fresh)
+    for i, vector in zip(missing, fresh):
+        cached[i] = vector
+
+# ==============================================================================
+# Streaming
+# ==============================================================================
+def _stream_stats(start, first_token_at, end, completion_tokens):
+    """
+    Timing of one streamed response. tokens_per_second is the generation rate
+    after the first token, i.e. how fast the text appears once it has started.
+    """
+    generation_time = end - first_token_at if first_token_at is not None else 0.0
+    return {
+        "time_to_first_token": first_token_at - start if first_token_at is not None else None,
+        "total_time": end - start,
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": completion_tokens / generation_time if generation_time > 0 else None,
+    }
+
+def stream_text(stream, start, stats, on_token=None):
+    """
+    Yields the text deltas of a streamed chat completion, calling on_token(delta)
+    for each, and fills the stats dict once the stream is done. start is the
+    time.perf_counter() value taken before the request was sent.
+    """
+    first_token_at = None
+    completion_tokens = None
+    deltas = 0
+    # Closing the stream when the consumer stops early (break, an exception)
+    # ends the HTTP response, so its connection goes back to the shared pool.
+    try:
+        for chunk in stream:
+            # With include_usage, the last chunk carries the token counts and no choices.
+            if getattr(chunk, "usage", None) is not None:
+                completion_tokens = chunk.usage.completion_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            deltas += 1
+            delta = chunk.choices[0].delta.content
+            if on_token is not None:
+                on_token(delta)
+            yield delta
+    finally:
+        stream.close()
+    # Servers that do not report usage send roughly one token per delta.
+    stats.update(_stream_stats(start, first_token_at, time.perf_counter(),
+                               completion_tokens if completion_tokens is not None else deltas))
+
+async def stream_text_async(stream, start, stats, on_token=None):
+    """
+    Async version of stream_text() for streams from an AsyncOpenAI client.
+    """
+    first_token_at = None
+    completion_tokens = None
+    deltas = 0
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                completion_tokens = chunk.usage.completion_tokens
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            deltas += 1
+            delta = chunk.choices[0].delta.content
+            if on_token is not None:
+                on_token(delta)
+            yield delta
+    finally:
+        await _close_async_stream(stream)
+    stats.update(_stream_stats(start, first_token_at, time.perf_counter(),
+                               completion_tokens if completion_tokens is not None else deltas))
+
+async def _close_async_stream(stream):
+    """Closes an AsyncStream (async close()) or an async generator wrapping one (aclose())."""
+    if hasattr(stream, "aclose"):
+        await stream.aclose()
+    else:
+        await stream.close()
+
+def _streaming_request(messages):
+    """Keyword arguments of a streamed gpt-3.5-turbo request that reports token usage."""
+    return {
+        "model": "gpt-3.5-turbo",
+        "messages": messages,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+
+# ==============================================================================
+# Shared clients
+# ==============================================================================
+# Agents with the same endpoint and key share one client, and so one HTTP
+# connection pool with keep-alive, instead of each opening its own. The pool
+# settings apply to clients created after configure_clients() is called.
+_client_settings = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "timeout": 60.0,
+    "connect_timeout": 5.0,
+    # HTTP/2 multiplexes concurrent requests over one connection; it needs
+    # the optional 'h2' package (pip install httpx[http2]).
+    "http2": importlib.util.find_spec("h2") is not None,
+    "max_retries": 2,
+}
+_clients = {}
+_clients_lock = threading.Lock()
+
+def configure_clients(**settings):
+    """
+    Changes the connection settings used for shared clients created from now on:
+    max_connections, max_keepalive_connections, keepalive_expiry (seconds),
+    timeout and connect_timeout (seconds), http2 and max_retries.
+    """
+    unknown = set(settings) - set(_client_settings)
+    if unknown:
+        raise ValueError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+    with _clients_lock:
+        _client_settings.update(settings)
+
+def _http_client_options():
+    settings = _client_settings
+    return {
+        "limits": httpx.Limits(max_connections=settings["max_connections"],
+                               max_keepalive_connections=settings["max_keepalive_connections"],
+                               keepalive_expiry=settings["keepalive_expiry"]),
+        "timeout": httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"]),
+        "http2": settings["http2"],
+    }
+
+def get_client(base_url, api_key):
+    """Returns the shared OpenAI client for a base URL and API key."""
+    with _clients_lock:
+        client = _clients.get(("sync", base_url, api_key))
+        if client is None:
+            client = OpenAI(base_url=base_url, api_key=api_key, max_retries=_client_settings["max_retries"],
+                            http_client=DefaultHttpxClient(**_http_client_options()))
+            _clients[("sync", base_url, api_key)] = client
+        return client
+
+def get_async_client(base_url, api_key):
+    """
+    Returns the shared AsyncOpenAI client for a base URL and API key. Async
+    clients are bound to the event loop that first uses them, so run all agents
+    of a process on a single loop.
+    """
+    with _clients_lock:
+        client = _clients.get(("async", base_url, api_key))
+        if client is None:
+            client = AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=_client_settings["max_retries"],
+                                 http_client=DefaultAsyncHttpxClient(**_http_client_options()))
+            _clients[("async", base_url, api_key)] = client
+        return client
+
 # ==============================================================================
 # 1. Direct Prompt Agent
 # ==============================================================================
@@ -17,15 +403,28 @@ class DirectPromptAgent:
     """
     An agent that interacts with an LLM by sending a prompt directly.
     """
-    def __init__(self, base_url, openai_api_key):
+    def __init__(self, base_url, openai_api_key, client=None, async_client=None):
         """
-        Initializes the agent with an OpenAI API key.
+        Initializes the agent with an OpenAI API key. A client and async_client
+        may be injected; by default the shared ones from get_client() and
+        get_async_client() are used.
         """
         self.base_url = base_url
         self.openai_api_key = openai_api_key
-        # Instantiate the OpenAI client
-        self.client = OpenAI(base_url = self.base_url, 
-                             api_key=self.openai_api_key)
+        # Use the injected clients, or the ones shared by every agent with the
+        # same endpoint and key.
+        self.client = client or get_client(self.base_url, self.openai_api_key)
+        self.async_client = async_client or get_async_client(self.base_url, self.openai_api_key)
+
+    def _messages(self, prompt):
+        """
+        Builds the chat messages sent to the LLM for a prompt.
+        """
+        return [
+            # Pass the user's prompt directly as a user message.
+            # Do not include a system prompt.
+            {"role": "user", "content": prompt}
+        ]
 
     def respond(self, prompt):
         """
@@ -34,15 +433,42 @@ class DirectPromptAgent:
         # Call the OpenAI API using the gpt-3.5-turbo model
         response = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                # Pass the user's prompt directly as a user message.
-                # Do not include a system prompt.
-                {"role": "user", "content": prompt}
-            ]
+            messages=self._messages(prompt)
         )
         # Return only the text content of the LLM's response. [cite: 212]
         return response.choices[0].message.content
 
+    async def respond_async(self, prompt):
+        """
+        Coroutine version of respond() using the shared async client.
+        """
+        response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._messages(prompt)
+        )
+        return response.choices[0].message.content
+
+    def respond_stream(self, prompt, on_token=None):
+        """
+        Streaming version of respond(): yields the response text in pieces as
+        they arrive and calls on_token(delta) for each one. Time to first token
+        and tokens per second are stored in self.last_stream_stats.
+        """
+        self.last_stream_stats = stats = {}
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(**_streaming_request(self._messages(prompt)))
+        yield from stream_text(stream, start, stats, on_token)
+
+    async def respond_stream_async(self, prompt, on_token=None):
+        """
+        Async generator version of respond_stream() using the shared async client.
+        """
+        self.last_stream_stats = stats = {}
+        start = time.perf_counter()
+        stream = await self.async_client.chat.completions.create(**_streaming_request(self._messages(prompt)))
+        async for delta in stream_text_async(stream, start, stats, on_token):
+            yield delta
+
 # ==============================================================================
 # 2. Augmented Prompt Agent
 # ==============================================================================
@@ -50,7 +476,7 @@ class AugmentedPromptAgent:
     """
     A specialized agent that responds according to a predefined persona.
     """
-    def __init__(self, base_url, persona, openai_api_key):
+    def __init__(self, base_url, persona, openai_api_key, client=None, async_client=None):
         """
         Initializes the agent with an API key and a persona.
         """
@@ -58,8 +484,19 @@ class AugmentedPromptAgent:
         self.openai_api_key = openai_api_key
         # Create an attribute to store the agent's persona.
         self.persona = persona
-        self.client = OpenAI(base_url = self.base_url, 
-                             api_key=self.openai_api_key)
+        self.client = client or get_client(self.base_url, self.openai_api_key)
+        self.async_client = async_client or get_async_client(self.base_url, self.openai_api_key)
+
+    def _messages(self, prompt):
+        """
+        Builds the chat messages sent to the LLM for a prompt.
+        """
+        return [
+            # Construct a system prompt to assume the defined persona and
+            # forget previous context.
+            {"role": "system", "content": f"You are a {self.persona}. Forget all previous conversational context."},
+            {"role": "user", "content": prompt}
+        ]
 
     def respond(self, prompt):
         """
@@ -68,56 +505,212 @@ class AugmentedPromptAgent:
         # Call the OpenAI API for chat completions.
         response = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                # Construct a system prompt to assume the defined persona and
-                # forget previous context.
-                {"role": "system", "content": f"You are a {self.persona}. Forget all previous conversational context."},
-                {"role": "user", "content": prompt}
-            ]
+            messages=self._messages(prompt)
         )
         # Return only the textual content of the response.
         return response.choices[0].message.content
 
+    async def respond_async(self, prompt):
+        """
+        Coroutine version of respond() using the shared async client.
+        """
+        response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._messages(prompt)
+        )
+        return response.choices[0].message.content
+
+    def respond_stream(self, prompt, on_token=None):
+        """
+        Streaming version of respond(): yields the response text in pieces as
+        they arrive and calls on_token(delta) for each one. Time to first token
+        and tokens per second are stored in self.last_stream_stats.
+        """
+        self.last_stream_stats = stats = {}
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(**_streaming_request(self._messages(prompt)))
+        yield from stream_text(stream, start, stats, on_token)
+
+    async def respond_stream_async(self, prompt, on_token=None):
+        """
+        Async generator version of respond_stream() using the shared async client.
+        """
+        self.last_stream_stats = stats = {}
+        start = time.perf_counter()
+        stream = await self.async_client.chat.completions.create(**_streaming_request(self._messages(prompt)))
+        async for delta in stream_text_async(stream, start, stats, on_token):
+            yield delta
+
 # ==============================================================================
 # 3. Knowledge Augmented Prompt Agent
 # ==============================================================================
+KNOWLEDGE_CHUNK_TOKENS = 250
+KNOWLEDGE_OVERLAP_TOKENS = 25
+
 class KnowledgeAugmentedPromptAgent:
     """
     An agent that uses a specific persona and provided knowledge to answer.
     """
-    def __init__(self, base_url, openai_api_key, persona, knowledge):
+    def __init__(self, base_url, openai_api_key, persona, knowledge, knowledge_token_budget=None,
+                 chunk_tokens=KNOWLEDGE_CHUNK_TOKENS, overlap_tokens=KNOWLEDGE_OVERLAP_TOKENS,
+                 embedding_model="text-embedding-3-large", embedding_cache=None, client=None, async_client=None):
         """
         Initializes the agent with an API key, a persona, and specific knowledge.
+        By default the whole knowledge is sent with every prompt. If
+        knowledge_token_budget is set and the knowledge is longer than that
+        many tokens, it is split into chunks of chunk_tokens tokens that are
+        embedded once, and each prompt is sent only the chunks most similar to
+        it, up to the budget. An optional EmbeddingCache keeps the chunk embeddings
+        across runs.
         """
         self.base_url = base_url
         self.openai_api_key = openai_api_key
         # Create attributes for persona and knowledge.
         self.persona = persona
         self.knowledge = knowledge
-        self.client = OpenAI(base_url = self.base_url, 
-                             api_key=self.openai_api_key)
+        self.knowledge_token_budget = knowledge_token_budget
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.embedding_model = embedding_model
+        self.embedding_cache = embedding_cache
+        self.client = client or get_client(self.base_url, self.openai_api_key)
+        self.async_client = async_client or get_async_client(self.base_url, self.openai_api_key)
+        # (knowledge, chunks, normalized chunk embeddings), built on first use.
+        self._knowledge_index = None
+        self._knowledge_index_lock = threading.Lock()
 
-    def respond(self, prompt):
+    def _over_budget(self):
+        return (self.knowledge_token_budget is not None
+                and estimate_tokens(self.knowledge) > self.knowledge_token_budget)
+
+    def _chunk_knowledge(self):
+        return list(chunk_text(self.knowledge, self.chunk_tokens, self.overlap_tokens))
+
+    def _get_knowledge_index(self):
+        """
+        The chunks of the knowledge and their embeddings, rebuilt whenever
+        self.knowledge has changed.
+        """
+        with self._knowledge_index_lock:
+            if self._knowledge_index is None or self._knowledge_index[0] != self.knowledge:
+                knowledge, chunks = self.knowledge, self._chunk_knowledge()
+                embeddings = embed_texts(self.client, chunks, self.embedding_model, cache=self.embedding_cache)
+                self._knowledge_index = (knowledge, chunks, normalize_rows(embeddings))
+            return self._knowledge_index
+
+    async def _get_knowledge_index_async(self):
+        """
+        Coroutine version of _get_knowledge_index() using the shared async client.
+        """
+        if self._knowledge_index is None or self._knowledge_index[0] != self.knowledge:
+            knowledge, chunks = self.knowledge, self._chunk_knowledge()
+            embeddings = await embed_texts_async(self.async_client, chunks, self.embedding_model,
+                                                 cache=self.embedding_cache)
+            self._knowledge_index = (knowledge, chunks, normalize_rows(embeddings))
+        return self._knowledge_index
+
+    def _select_knowledge(self, chunks, chunk_embeddings, prompt_embedding):
+        """
+        The chunks most similar to the prompt that fit in the token budget,
+        joined in their original order.
+        """
+        scores = chunk_embeddings @ normalize_rows(prompt_embedding)
+        chunk_budget = max(1, self.knowledge_token_budget // max(1, self.chunk_tokens - self.overlap_tokens))
+        selected, used_tokens = [], 0
+        for i in top_k_indices(scores, chunk_budget + 1).tolist():
+            tokens = estimate_tokens(chunks[i])
+            if selected and used_tokens + tokens > self.knowledge_token_budget:
+                break
+            selected.append(i)
+            used_tokens += tokens
+        return "\n...\n".join(chunks[i] for i in sorted(selected))
+
+    def relevant_knowledge(self, prompt):
+        """
+        The knowledge sent with a prompt: all of it if it fits in the token
+        budget, otherwise the most relevant chunks.
+        """
+        if not self._over_budget():
+            return self.knowledge
+        _, chunks, chunk_embeddings = self._get_knowledge_index()
+        prompt_embedding = embed_texts(self.client, [prompt], self.embedding_model, cache=self.embedding_cache)[0]
+        return self._select_knowledge(chunks, chunk_embeddings, prompt_embedding)
+
+    async def relevant_knowledge_async(self, prompt):
+        """
+        Coroutine version of relevant_knowledge() using the shared async client.
+        """
+        if not self._over_budget():
+            return self.knowledge
+        _, chunks, chunk_embeddings = await self._get_knowledge_index_async()
+        prompt_embeddings = await embed_texts_async(self.async_client, [prompt], self.embedding_model,
+                                                    cache=self.embedding_cache)
+        return self._select_knowledge(chunks, chunk_embeddings, prompt_embeddings[0])
+
+    def _messages(self, prompt, knowledge=None):
         """
         Constructs a detailed system message with persona and knowledge to guide the LLM's response.
+        knowledge defaults to all of self.knowledge.
         """
+        if knowledge is None:
+            knowledge = self.knowledge
         # Construct the detailed system message as specified.
         system_message = (
             f"You are {self.persona} knowledge-based assistant. Forget all previous context. " 
-            f"Use only the following knowledge to answer, do not use your own knowledge: {self.knowledge}. "
+            f"Use only the following knowledge to answer, do not use your own knowledge: {knowledge}. "
             "Answer the prompt based on this knowledge, not your own."
         )
-        
+        return [
+            {"role": "system", "content": system_message},
+            # Append the user's input prompt as a separate message.
+            {"role": "user", "content": prompt}
+        ]
+
+    def respond(self, prompt):
+        """
+        Answers the prompt from the agent's persona and knowledge.
+        """
         response = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_message},
-                # Append the user's input prompt as a separate message.
-                {"role": "user", "content": prompt}
-            ]
+            messages=self._messages(prompt, self.relevant_knowledge(prompt))
+        )
+        return response.choices[0].message.content
+
+    async def respond_async(self, prompt):
+        """
+        Coroutine version of respond() using the shared async client.
+        """
+        response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._messages(prompt, await self.relevant_knowledge_async(prompt))
         )
         return response.choices[0].message.content
 
+    def respond_stream(self, prompt, on_token=None):
+        """
+        Streaming version of respond(): yields the response text in pieces as
+        they arrive and calls on_token(delta) for each one. Time to first token
+        and tokens per second are stored in self.last_stream_stats.
+        """
+        self.last_stream_stats = stats = {}
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            **_streaming_request(self._messages(prompt, self.relevant_knowledge(prompt)))
+        )
+        yield from stream_text(stream, start, stats, on_token)
+
+    async def respond_stream_async(self, prompt, on_token=None):
+        """
+        Async generator version of respond_stream() using the shared async client.
+        """
+        self.last_stream_stats = stats = {}
+        start = time.perf_counter()
+        stream = await self.async_client.chat.completions.create(
+            **_streaming_request(self._messages(prompt, await self.relevant_knowledge_async(prompt)))
+        )
+        async for delta in stream_text_async(stream, start, stats, on_token):
+            yield delta
+
 # ==============================================================================
 # 4. RAG Knowledge Prompt Agent
 # ==============================================================================
@@ -141,13 +734,31 @@ class RAGKnowledgePromptAgent:
 # ==============================================================================
 # 5. Evaluation Agent
 # ==============================================================================
+# Token limits of the judge calls: a Yes/No answer needs only a couple of
+# tokens; a structured verdict also carries the correction instructions.
+JUDGE_MAX_TOKENS = 5
+VERDICT_MAX_TOKENS = 400
+
 class EvaluationAgent:
     """
     An agent that assesses responses from another agent against given criteria.
     """
-    def __init__(self, base_url, openai_api_key, persona, evaluation_criteria, agent_to_evaluate, max_interactions=5):
+    def __init__(self, base_url, openai_api_key, persona, evaluation_criteria, agent_to_evaluate, max_interactions=5,
+                 structured=False, judge_max_tokens=JUDGE_MAX_TOKENS, verdict_max_tokens=VERDICT_MAX_TOKENS,
+                 candidates=1, client=None, async_client=None):
         """
         Initializes the evaluation agent.
+        By default each refinement round makes a Yes/No judge call (limited to
+        judge_max_tokens) and, if the response fails, a second call for
+        correction instructions. With structured=True a single call returns a
+        JSON verdict together with the instructions (limited to
+        verdict_max_tokens), saving one round trip per failed iteration.
+        With candidates > 1, the first iteration generates that many worker
+        responses concurrently and judges each as soon as it is ready; the
+        refinement loop only continues if none of them passes. This trades
+        cost for latency: all candidates' worker calls are paid for even when
+        the first one passes, since a request already sent cannot be recalled.
+        Only the judge calls of the candidates that finish later are saved.
         """
         self.base_url = base_url
         self.openai_api_key = openai_api_key
@@ -155,8 +766,229 @@ class EvaluationAgent:
         self.evaluation_criteria = evaluation_criteria
         self.agent_to_evaluate = agent_to_evaluate
         self.max_interactions = max_interactions
-        self.client = OpenAI(base_url = self.base_url, 
-                             api_key=self.openai_api_key)
+        self.structured = structured
+        self.judge_max_tokens = judge_max_tokens
+        self.verdict_max_tokens = verdict_max_tokens
+        self.candidates = candidates
+        self.client = client or get_client(self.base_url, self.openai_api_key)
+        self.async_client = async_client or get_async_client(self.base_url, self.openai_api_key)
+
+    def _evaluation_messages(self, worker_response):
+        """
+        Builds the Yes/No judge request for a worker response.
+        """
+        # Formulate an evaluation prompt that incorporates the predefined criteria.
+        evaluation_prompt = f"Evaluate the following response based on these criteria: '{self.evaluation_criteria}'. Response: '{worker_response}'. Does it meet the criteria? Respond with only 'Yes' or 'No'."
+        return [{"role": "user", "content": evaluation_prompt}]
+
+    def _correction_messages(self, worker_response):
+        """
+        Builds the request for instructions on correcting a failed response.
+        """
+        correction_prompt = f"The following response did not meet the criteria '{self.evaluation_criteria}'. Response: '{worker_response}'. Please provide clear instructions on how to correct it."
+        return [{"role": "user", "content": correction_prompt}]
+
+    def _verdict_messages(self, worker_response):
+        """
+        Builds the single structured request that asks for the verdict and the
+        correction instructions at once.
+        """
+        verdict_prompt = (
+            f"Evaluate the following response based on these criteria: '{self.evaluation_criteria}'. "
+            f"Response: '{worker_response}'. "
+            'Answer with a JSON object {"meets_criteria": true or false, "instructions": "..."}, where '
+            "instructions are clear instructions on how to correct the response, or an empty string if it "
+            "meets the criteria."
+        )
+        return [{"role": "user", "content": verdict_prompt}]
+
+    def _verdict_request(self, worker_response):
+        return {
+            "model": "gpt-3.5-turbo",
+            "messages": self._verdict_messages(worker_response),
+            "temperature": 0,
+            "max_tokens": self.verdict_max_tokens,
+            "response_format": {"type": "json_object"},
+        }
+
+    @staticmethod
+    def _parse_verdict(response_text):
+        """
+        Parses a structured verdict into (passed, evaluation, correction_instructions).
+        evaluation is 'Yes' or 'No' as in the two-call mode. A reply that is not
+        the expected JSON passes only if it starts with 'yes', and is otherwise
+        used as the instructions.
+        """
+        text = response_text.strip()
+        # Drop a Markdown code fence around the JSON, if any.
+        fence = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+        if fence:
+            text = fence.group(1)
+        try:
+            verdict = json.loads(text)
+            passed = verdict["meets_criteria"]
+            if isinstance(passed, str):
+                passed = passed.strip().lower() in ("true", "yes")
+            instructions = str(verdict.get("instructions") or "")
+        except (ValueError, TypeError, KeyError, AttributeError):
+            passed = text.lower().startswith("yes")
+            instructions = text
+        if passed:
+            return True, "Yes", None
+        return False, "No", instructions
+
+    @staticmethod
+    def _refined_prompt(prompt, worker_response, correction_instructions):
+        """
+        The prompt for the next iteration, including the correction instructions.
+        """
+        return f"Original prompt: '{prompt}'. Previous attempt: '{worker_response}'. Please refine the response using these instructions: '{correction_instructions}'"
+
+    def _failure(self):
+        """
+        The result returned when max_interactions is reached.
+        """
+        return {
+            "final_response": "Failed to generate a satisfactory response within the interaction limit.",
+            "evaluation": "Failed",
+            "iteration_count": self.max_interactions
+        }
+
+    def _verdict(self, worker_response):
+        """
+        Judges a worker response. Returns (passed, evaluation, correction_instructions);
+        the instructions are None if the response passed, and also in the
+        two-call mode, where they need a call of their own (_corrections).
+        """
+        if self.structured:
+            response = self.client.chat.completions.create(**self._verdict_request(worker_response))
+            return self._parse_verdict(response.choices[0].message.content)
+
+        # 1. Evaluate the response
+        evaluation_response = self.client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._evaluation_messages(worker_response),
+            temperature=0,  # Set temperature to 0 for this call.
+            max_tokens=self.judge_max_tokens  # Only 'Yes' or 'No' is needed.
+        )
+        evaluation_result = evaluation_response.choices[0].message.content.strip()
+        return "yes" in evaluation_result.lower(), evaluation_result, None
+
+    def _corrections(self, worker_response):
+        """
+        Asks for instructions on correcting a failed response.
+        """
+        # 2. Generate correction instructions if evaluation is "No"
+        correction_response = self.client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._correction_messages(worker_response),
+            temperature=0 # Use temperature=0 for generating instructions.
+        )
+        return correction_response.choices[0].message.content
+
+    def _judge(self, worker_response):
+        """
+        Judges a worker response and, if it failed, makes sure there are
+        correction instructions. Returns (passed, evaluation, correction_instructions).
+        """
+        passed, evaluation_result, correction_instructions = self._verdict(worker_response)
+        if not passed and correction_instructions is None:
+            correction_instructions = self._corrections(worker_response)
+        return passed, evaluation_result, correction_instructions
+
+    def _best_candidate(self, prompt):
+        """
+        Generates self.candidates worker responses on a thread pool and judges
+        each one as soon as it is ready. Returns (worker_response, passed,
+        evaluation, correction_instructions) of the first candidate to pass,
+        or of the first to finish if none passes. Slower candidates are not
+        waited for once one has passed: their worker calls still complete in
+        the background, but they make no judge call.
+        """
+        # Set once a candidate has passed; the others then stop before their next call.
+        passed = threading.Event()
+
+        def candidate():
+            worker_response = self.agent_to_evaluate.respond(prompt)
+            if passed.is_set():
+                return None
+            return (worker_response, *self._verdict(worker_response))
+
+        pool = ThreadPoolExecutor(max_workers=self.candidates)
+        try:
+            # Each candidate runs in a copy of the caller's context (e.g. the tracing span).
+            futures = [pool.submit(contextvars.copy_context().run, candidate) for _ in range(self.candidates)]
+            first_failed = None
+            for future in as_completed(futures):
+                result = future.result()
+                if result[1]:
+                    return result
+                first_failed = first_failed or result
+            return first_failed
+        finally:
+            passed.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _verdict_async(self, worker_response):
+        """
+        Coroutine version of _verdict() using the shared async client.
+        """
+        if self.structured:
+            response = await self.async_client.chat.completions.create(**self._verdict_request(worker_response))
+            return self._parse_verdict(response.choices[0].message.content)
+
+        evaluation_response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._evaluation_messages(worker_response),
+            temperature=0,
+            max_tokens=self.judge_max_tokens
+        )
+        evaluation_result = evaluation_response.choices[0].message.content.strip()
+        return "yes" in evaluation_result.lower(), evaluation_result, None
+
+    async def _corrections_async(self, worker_response):
+        """
+        Coroutine version of _corrections() using the shared async client.
+        """
+        correction_response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._correction_messages(worker_response),
+            temperature=0
+        )
+        return correction_response.choices[0].message.content
+
+    async def _judge_async(self, worker_response):
+        """
+        Coroutine version of _judge() using the shared async client.
+        """
+        passed, evaluation_result, correction_instructions = await self._verdict_async(worker_response)
+        if not passed and correction_instructions is None:
+            correction_instructions = await self._corrections_async(worker_response)
+        return passed, evaluation_result, correction_instructions
+
+    async def _best_candidate_async(self, prompt):
+        """
+        Coroutine version of _best_candidate(): the candidates run as tasks, and
+        the ones still running are cancelled once one has passed, which also
+        aborts their pending API requests. Workers without respond_async()
+        run in a thread and finish their call in the background.
+        """
+        async def candidate():
+            worker_response = await self._worker_respond_async(prompt)
+            return (worker_response, *await self._verdict_async(worker_response))
+
+        tasks = [asyncio.ensure_future(candidate()) for _ in range(self.candidates)]
+        try:
+            first_failed = None
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result[1]:
+                    return result
+                first_failed = first_failed or result
+            return first_failed
+        finally:
+            for task in tasks:
+                task.cancel()
 
     def evaluate(self, prompt):
         """
@@ -164,22 +996,17 @@ class EvaluationAgent:
         """
         # Create a loop that is limited by max_interactions.
         for i in range(self.max_interactions):
-            # Retrieve a response from the worker agent.
-            worker_response = self.agent_to_evaluate.respond(prompt)
-            
-            # 1. Evaluate the response
-            # Formulate an evaluation prompt that incorporates the predefined criteria.
-            evaluation_prompt = f"Evaluate the following response based on these criteria: '{self.evaluation_criteria}'. Response: '{worker_response}'. Does it meet the criteria? Respond with only 'Yes' or 'No'."
-
-            # Define the message structure for evaluation.
-            evaluation_response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": evaluation_prompt}],
-                temperature=0  # Set temperature to 0 for this call.
-            )
-            evaluation_result = evaluation_response.choices[0].message.content.strip()
-
-            if "yes" in evaluation_result.lower():
+            if i == 0 and self.candidates > 1:
+                # Try several responses at once; refine only if none passes.
+                worker_response, passed, evaluation_result, correction_instructions = self._best_candidate(prompt)
+                if not passed and correction_instructions is None:
+                    correction_instructions = self._corrections(worker_response)
+            else:
+                # Retrieve a response from the worker agent.
+                worker_response = self.agent_to_evaluate.respond(prompt)
+                passed, evaluation_result, correction_instructions = self._judge(worker_response)
+
+            if passed:
                 # If the response meets criteria, break the loop and return the results.
                 return {
                     "final_response": worker_response,
@@ -187,79 +1014,428 @@ class EvaluationAgent:
                     "iteration_count": i + 1
                 } # [cite: 296]
 
-            # 2. Generate correction instructions if evaluation is "No"
-            # Define the message structure to generate correction instructions.
-            correction_prompt = f"The following response did not meet the criteria '{self.evaluation_criteria}'. Response: '{worker_response}'. Please provide clear instructions on how to correct it."
-            
-            correction_response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": correction_prompt}],
-                temperature=0 # Use temperature=0 for generating instructions.
-            )
-            correction_instructions = correction_response.choices[0].message.content
-
             # Update the prompt for the next iteration to include correction instructions.
-            prompt = f"Original prompt: '{prompt}'. Previous attempt: '{worker_response}'. Please refine the response using these instructions: '{correction_instructions}'"
-        
+            prompt = self._refined_prompt(prompt, worker_response, correction_instructions)
+
         # If max_interactions is reached, return the last response.
-        return {
-            "final_response": "Failed to generate a satisfactory response within the interaction limit.",
-            "evaluation": "Failed",
-            "iteration_count": self.max_interactions
-        }
+        return self._failure()
+
+    async def _worker_respond_async(self, prompt):
+        """
+        Gets a worker response without blocking the event loop. Workers without
+        respond_async() run in a thread.
+        """
+        if hasattr(self.agent_to_evaluate, "respond_async"):
+            return await self.agent_to_evaluate.respond_async(prompt)
+        return await asyncio.to_thread(self.agent_to_evaluate.respond, prompt)
+
+    async def evaluate_async(self, prompt):
+        """
+        Coroutine version of evaluate() using the shared async client.
+        """
+        for i in range(self.max_interactions):
+            if i == 0 and self.candidates > 1:
+                worker_response, passed, evaluation_result, correction_instructions = \
+                    await self._best_candidate_async(prompt)
+                if not passed and correction_instructions is None:
+                    correction_instructions = await self._corrections_async(worker_response)
+            else:
+                worker_response = await self._worker_respond_async(prompt)
+                passed, evaluation_result, correction_instructions = await self._judge_async(worker_response)
+
+            if passed:
+                return {
+                    "final_response": worker_response,
+                    "evaluation": evaluation_result,
+                    "iteration_count": i + 1
+                }
+
+            prompt = self._refined_prompt(prompt, worker_response, correction_instructions)
+
+        return self._failure()
 
 # ==============================================================================
 # 6. Routing Agent
 # ==============================================================================
+ROUTING_CACHE_SIZE = 1024
+ROUTING_CACHE_THRESHOLD = 0.9
+ROUTING_CACHE_DIMENSIONS = 1024
+
+def _routing_key(prompt):
+    """A prompt with case and whitespace normalized, so trivially different prompts share a key."""
+    return " ".join(prompt.lower().split())
+
+class RoutingCache:
+    """
+    A bounded LRU cache of routing decisions, so repeated and near-duplicate
+    prompts are routed without embedding them.
+
+    A prompt is first looked up by its normalized text. Failing that, it is
+    compared with the cached prompts by the cosine similarity of their hashed
+    character-trigram vectors, computed locally; the most similar prompt's
+    decision is reused if the similarity is at least threshold. Anything below
+    falls through to a fresh embedding, so keep the threshold high: prompts for
+    different agents often share most of their words (a threshold above 1
+    only reuses exact matches). At most max_entries decisions are kept; the
+    least recently used are evicted first.
+    """
+    def __init__(self, max_entries=ROUTING_CACHE_SIZE, threshold=ROUTING_CACHE_THRESHOLD,
+                 dimensions=ROUTING_CACHE_DIMENSIONS):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (row, decision)
+        # One unit trigram vector per entry; rows of evicted entries are reused.
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self._row_keys = [None] * max_entries
+        # Free rows are handed out lowest first, so only the first _rows_used
+        # rows are ever searched.
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._rows_used = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, key):
+        # Python's string hash is salted per process, which is fine for a cache
+        # that lives in memory.
+        padded = f"  {key} "
+        indices = [hash(padded[i:i + 3]) % self.dimensions for i in range(len(padded) - 2)]
+        vector = np.bincount(indices, minlength=self.dimensions).astype(np.float32)
+        return normalize_rows(vector)
+
+    def get(self, prompt):
+        """Returns the cached decision for a prompt or a near-duplicate of it, or None."""
+        key = _routing_key(prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry[1]
+            if self._entries and self.threshold <= 1.0:
+                similarities = self._vectors[:self._rows_used] @ self._vector(key)
+                row = int(np.argmax(similarities))
+                if similarities[row] >= self.threshold:
+                    cached_key = self._row_keys[row]
+                    self._entries.move_to_end(cached_key)
+                    self.similar_hits += 1
+                    return self._entries[cached_key][1]
+            self.misses += 1
+            return None
+
+    def put(self, prompt, decision):
+        """Caches the decision made for a prompt, evicting the least recently used entry if full."""
+        key = _routing_key(prompt)
+        with self._lock:
+            if key in self._entries:
+                row = self._entries.pop(key)[0]
+            else:
+                if not self._free_rows:
+                    _, (evicted_row, _) = self._entries.popitem(last=False)
+                    self._vectors[evicted_row] = 0.0
+                    self._row_keys[evicted_row] = None
+                    self._free_rows.append(evicted_row)
+                row = self._free_rows.pop()
+                self._rows_used = max(self._rows_used, row + 1)
+            self._vectors[row] = self._vector(key)
+            self._row_keys[row] = key
+            self._entries[key] = (row, decision)
+
+    def clear(self):
+        """Forgets every decision, e.g. when the agents change."""
+        with self._lock:
+            self._entries.clear()
+            self._vectors[:] = 0.0
+            self._row_keys = [None] * self.max_entries
+            self._free_rows = list(range(self.max_entries - 1, -1, -1))
+            self._rows_used = 0
+
+    def stats(self):
+        """Returns the hit and miss counters and the number of cached decisions."""
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
+
 class RoutingAgent:
     """
     An agent that directs prompts to the most appropriate specialized agent.
     """
-    def __init__(self, base_url, openai_api_key):
+    def __init__(self, base_url, openai_api_key, embedding_model="text-embedding-3-large", embedding_cache=None,
+                 routing_cache=None, metrics=None, dimensions=None, precision="float32", client=None,
+                 async_client=None):
         """
-        Initializes the routing agent.
+        Initializes the routing agent. An optional EmbeddingCache lets prompt and
+        description embeddings be reused across calls and process restarts; an
+        optional RoutingCache reuses the decisions made for repeated and
+        near-duplicate prompts without embedding them at all. Every decision is
+        reported to metrics, if given, through its record_routing(names,
+        seconds, source) method, with source "cache" or "embedding".
+        dimensions requests shortened embeddings from the model, and precision
+        ("float32", "bfloat16" or "int8") is how the description embeddings are
+        stored.
         """
         self.base_url = base_url
         self.openai_api_key = openai_api_key
+        self.embedding_model = embedding_model
+        self.embedding_cache = embedding_cache
+        self.routing_cache = routing_cache
+        self.metrics = metrics
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision '{precision}'; expected one of {', '.join(PRECISIONS)}.")
+        self.dimensions = dimensions
+        self.precision = precision
+        self.client = client or get_client(self.base_url, self.openai_api_key)
+        self.async_client = async_client or get_async_client(self.base_url, self.openai_api_key)
+        # Normalized agent description embeddings, one row per agent, stored at
+        # the chosen precision (with per-row scales for int8). They are built
+        # when agents are registered, not on every prompt.
+        self._description_matrix = None
+        self._description_scales = None
+        self._indexed_descriptions = ()
         # Define an 'agents' attribute to store agent details.
         self.agents = []
-        self.client = OpenAI(base_url = self.base_url, 
-                             api_key=self.openai_api_key)
 
-    def get_embedding(self, text, model="text-embedding-3-large"):
+    @property
+    def agents(self):
+        """The registered agents, each a dict with 'name', 'description' and 'func'."""
+        return self._agents
+
+    @agents.setter
+    def agents(self, agents):
+        """
+        Registers the agents and embeds their descriptions in a single request.
+        """
+        self._agents = agents
+        self._build_description_index()
+
+    def _descriptions_to_index(self):
+        """
+        The current agent descriptions, or None if the index is up to date.
+        """
+        descriptions = tuple(agent['description'] for agent in self._agents)
+        return None if descriptions == self._indexed_descriptions else descriptions
+
+    def _set_description_index(self, descriptions, embeddings):
+        if descriptions:
+            self._description_matrix, self._description_scales = quantize(normalize_rows(embeddings), self.precision)
+        else:
+            self._description_matrix = self._description_scales = None
+        self._indexed_descriptions = descriptions
+        # Cached decisions refer to the previous agents.
+        if self.routing_cache is not None:
+            self.routing_cache.clear()
+
+    def _build_description_index(self):
+        """
+        Embeds the agent descriptions into the description matrix. Nothing is
+        sent to the API if the descriptions have not changed since the last build.
+        """
+        descriptions = self._descriptions_to_index()
+        if descriptions is not None:
+            embeddings = embed_texts(self.client, descriptions, self.embedding_model,
+                                     cache=self.embedding_cache, dimensions=self.dimensions)
+            self._set_description_index(descriptions, embeddings)
+
+    async def _build_description_index_async(self):
+        descriptions = self._descriptions_to_index()
+        if descriptions is not None:
+            embeddings = await embed_texts_async(self.async_client, descriptions, self.embedding_model,
+                                                 cache=self.embedding_cache, dimensions=self.dimensions)
+            self._set_description_index(descriptions, embeddings)
+
+    def get_embedding(self, text, model=None):
         """
         Calculates text embeddings using the specified OpenAI model.
         """
-        text = text.replace("\n", " ")
-        return self.client.embeddings.create(input=[text], model=model).data[0].embedding
+        return embed_texts(self.client, [text], model or self.embedding_model, cache=self.embedding_cache,
+                           dimensions=self.dimensions)[0]
+
+    async def get_embedding_async(self, text, model=None):
+        """
+        Coroutine version of get_embedding() using the shared async client.
+        """
+        embeddings = await embed_texts_async(self.async_client, [text], model or self.embedding_model,
+                                             cache=self.embedding_cache, dimensions=self.dimensions)
+        return embeddings[0]
+
+    def _similarities(self, embeddings):
+        """
+        Cosine similarities of a matrix of prompt embeddings to every agent
+        description, one row per prompt.
+        """
+        # With unit rows the dot products are the cosine similarities.
+        return quantized_scores(normalize_rows(embeddings), self._description_matrix, self._description_scales)
+
+    def _best_agent(self, prompt_embedding):
+        """
+        Returns the index of the agent whose description is most similar to the prompt.
+        """
+        # Score the prompt against every agent description at once.
+        return int(np.argmax(self._similarities(np.atleast_2d(prompt_embedding))[0]))
+
+    def _cached_agent(self, prompt):
+        """
+        Returns the agent the routing cache chose for the prompt, or None.
+        """
+        if self.routing_cache is None:
+            return None
+        index = self.routing_cache.get(prompt)
+        return self._agents[index] if index is not None and index < len(self._agents) else None
+
+    def _record(self, start, agents, source):
+        if self.metrics is not None and agents:
+            self.metrics.record_routing([agent['name'] for agent in agents], time.perf_counter() - start, source)
+
+    def _remember(self, prompt, index):
+        if self.routing_cache is not None:
+            self.routing_cache.put(prompt, index)
+        return self._agents[index]
+
+    def select_agent(self, prompt):
+        """
+        Returns the registered agent best suited to the prompt, without calling
+        it, or None if no agents are registered.
+        """
+        start = time.perf_counter()
+        # Agents appended to the list after registration are picked up here.
+        self._build_description_index()
+        if not self._agents:
+            return None
+        agent = self._cached_agent(prompt)
+        if agent is not None:
+            self._record(start, [agent], "cache")
+            return agent
+        # Compute the embedding for the user input prompt.
+        agent = self._remember(prompt, self._best_agent(self.get_embedding(prompt)))
+        self._record(start, [agent], "embedding")
+        return agent
+
+    async def select_agent_async(self, prompt):
+        """
+        Coroutine version of select_agent() using the shared async client.
+        """
+        start = time.perf_counter()
+        await self._build_description_index_async()
+        if not self._agents:
+            return None
+        agent = self._cached_agent(prompt)
+        if agent is not None:
+            self._record(start, [agent], "cache")
+            return agent
+        agent = self._remember(prompt, self._best_agent(await self.get_embedding_async(prompt)))
+        self._record(start, [agent], "embedding")
+        return agent
+
+    def _cached_agents(self, prompts):
+        """
+        The agents the routing cache has for the prompts (None where it has
+        none), and the positions of the prompts that still need routing.
+        """
+        chosen = [self._cached_agent(prompt) for prompt in prompts]
+        return chosen, [i for i, agent in enumerate(chosen) if agent is None]
+
+    def _record_batch(self, start, chosen, missing):
+        if self.metrics is not None:
+            missing = set(missing)
+            self._record(start, [agent for i, agent in enumerate(chosen) if i not in missing], "cache")
+
+    def _best_agents(self, embeddings):
+        # One product scores every prompt against every agent description.
+        return np.argmax(self._similarities(embeddings), axis=1)
+
+    def _choose_agents(self, prompts, chosen, missing, embeddings):
+        for i, index in zip(missing, self._best_agents(embeddings)):
+            chosen[i] = self._remember(prompts[i], int(index))
+        return chosen
+
+    def agents_for_embeddings(self, embeddings, start=None):
+        """
+        Returns the best agent for each row of a matrix of prompt embeddings made
+        with embedding_model and dimensions, so embeddings computed for another purpose can be
+        reused for routing. The routing cache is not consulted. start is the
+        time.perf_counter() value the routing began at, e.g. before the
+        embeddings were requested, so metrics include that request (default: now).
+        """
+        start = time.perf_counter() if start is None else start
+        self._build_description_index()
+        if not self._agents:
+            return [None] * len(embeddings)
+        agents = [self._agents[int(index)] for index in self._best_agents(embeddings)]
+        self._record(start, agents, "embedding")
+        return agents
+
+    def select_agents(self, prompts):
+        """
+        Batch version of select_agent(): returns the best agent for each prompt,
+        or Nones if no agents are registered. Prompts the routing cache cannot
+        answer are embedded in batched requests and routed together.
+        """
+        start = time.perf_counter()
+        prompts = list(prompts)
+        self._build_description_index()
+        if not self._agents:
+            return [None] * len(prompts)
+        chosen, missing = self._cached_agents(prompts)
+        self._record_batch(start, chosen, missing)
+        if not missing:
+            return chosen
+        embeddings = embed_texts(self.client, [prompts[i] for i in missing], self.embedding_model,
+                                 cache=self.embedding_cache, dimensions=self.dimensions)
+        chosen = self._choose_agents(prompts, chosen, missing, embeddings)
+        self._record(start, [chosen[i] for i in missing], "embedding")
+        return chosen
+
+    async def select_agents_async(self, prompts):
+        """
+        Coroutine version of select_agents() using the shared async client.
+        """
+        start = time.perf_counter()
+        prompts = list(prompts)
+        await self._build_description_index_async()
+        if not self._agents:
+            return [None] * len(prompts)
+        chosen, missing = self._cached_agents(prompts)
+        self._record_batch(start, chosen, missing)
+        if not missing:
+            return chosen
+        embeddings = await embed_texts_async(self.async_client, [prompts[i] for i in missing], self.embedding_model,
+                                             cache=self.embedding_cache, dimensions=self.dimensions)
+        chosen = self._choose_agents(prompts, chosen, missing, embeddings)
+        self._record(start, [chosen[i] for i in missing], "embedding")
+        return chosen
 
     def route(self, prompt):
         """
         Routes a user prompt to the best agent based on cosine similarity.
         """
-        # Compute the embedding for the user input prompt.
-        prompt_embedding = self.get_embedding(prompt)
-        
-        best_agent = None
-        max_similarity = -1
-
-        # Iterate over each agent to find the best match.
-        for agent in self.agents:
-            # Compute the embedding for each agent's description.
-            description_embedding = self.get_embedding(agent['description'])
-            # Calculate cosine similarity.
-            similarity = cosine_similarity(prompt_embedding, description_embedding)
-            
-            if similarity > max_similarity:
-                max_similarity = similarity
-                # Select the agent with the highest similarity score.
-                best_agent = agent
-        
-        if best_agent:
-            # Return the response obtained by calling the selected agent's function.
-            return best_agent['func'](prompt)
-        else:
+        best_agent = self.select_agent(prompt)
+        if best_agent is None:
+            return "No suitable agent found for the prompt."
+
+        # Return the response obtained by calling the selected agent's function.
+        return best_agent['func'](prompt)
+
+    async def route_async(self, prompt):
+        """
+        Coroutine version of route(). An agent 'func' may be a coroutine function,
+        which is awaited; plain functions run in a thread so that blocking calls
+        do not stall the event loop.
+        """
+        best_agent = await self.select_agent_async(prompt)
+        if best_agent is None:
             return "No suitable agent found for the prompt."
+        if inspect.iscoroutinefunction(best_agent['func']):
+            return await best_agent['func'](prompt)
+        return await asyncio.to_thread(best_agent['func'], prompt)
 
 # ==============================================================================
 # 7. Action Planning Agent
@@ -268,20 +1444,20 @@ class ActionPlanningAgent:
     """
     An agent that extracts and lists the steps required to execute a task.
     """
-    def __init__(self, base_url, openai_api_key, knowledge):
+    def __init__(self, base_url, openai_api_key, knowledge, client=None, async_client=None):
         """
         Initializes the agent with an API key and knowledge. [cite: 347]
         """
         self.base_url = base_url
         self.openai_api_key = openai_api_key
         self.knowledge = knowledge
-        # Instantiate the OpenAI client. [cite: 348]
-        self.client = OpenAI(base_url = self.base_url, 
-                             api_key=self.openai_api_key)
+        # Use the injected clients or the shared ones. [cite: 348]
+        self.client = client or get_client(self.base_url, self.openai_api_key)
+        self.async_client = async_client or get_async_client(self.base_url, self.openai_api_key)
 
-    def extract_steps_from_prompt(self, prompt):
+    def _messages(self, prompt):
         """
-        Uses an LLM to extract a list of action steps from a user prompt.
+        Builds the chat messages sent to the LLM for a prompt.
         """
         # Create a system prompt defining the agent's role and knowledge use. [cite: 351, 352]
         system_prompt = (
@@ -290,20 +1466,123 @@ class ActionPlanningAgent:
             f"Use the following knowledge to guide your extraction: {self.knowledge}. "
             "List only the steps, one per line."
         )
+        return [
+            {"role": "system", "content": system_prompt},
+            # Include the user's input prompt. [cite: 353]
+            {"role": "user", "content": prompt}
+        ]
+
+    @staticmethod
+    def _parse_steps(response_text):
+        """
+        Process the response to create a clean list of actions. [cite: 355]
+        """
+        return [line.strip() for line in response_text.split('\n') if line.strip()]
 
+    def extract_steps_from_prompt(self, prompt):
+        """
+        Uses an LLM to extract a list of action steps from a user prompt.
+        """
         # Send a request to the gpt-3.5-turbo model. [cite: 350]
         response = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                # Include the user's input prompt. [cite: 353]
-                {"role": "user", "content": prompt}
-            ]
+            messages=self._messages(prompt)
         )
-        
+
         # Extract the text response. [cite: 354]
         response_text = response.choices[0].message.content
-        
-        # Process the response to create a clean list of actions. [cite: 355]
-        steps = [line.strip() for line in response_text.split('\n') if line.strip()]
+        return self._parse_steps(response_text)
+
+    async def extract_steps_async(self, prompt):
+        """
+        Coroutine version of extract_steps_from_prompt() using the shared async client.
+        """
+        response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._messages(prompt)
+        )
+        return self._parse_steps(response.choices[0].message.content)
+
+    def _graph_messages(self, prompt):
+        """
+        Builds the chat messages asking for the steps and their dependencies as JSON.
+        """
+        system_prompt = (
+            "You are an Action Planning Agent. Your role is to extract a list of "
+            "actionable steps from the user's prompt based on the knowledge provided. "
+            f"Use the following knowledge to guide your extraction: {self.knowledge}. "
+            "Return the steps as a JSON array of objects with the keys \"id\" (an integer, "
+            "starting at 1), \"step\" (the text of the step) and \"depends_on\" (the ids of "
+            "the earlier steps whose results this step needs, or an empty list). "
+            "Only list a dependency if the step cannot be done without that result. "
+            "Return only the JSON array."
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+
+    @classmethod
+    def _parse_step_graph(cls, response_text):
+        """
+        Parses the JSON step graph into dicts with 'id', 'step' and 'depends_on'.
+        Only dependencies on earlier steps are kept, so the graph has no cycles.
+        If the response is not valid JSON, or its step ids are not unique, the
+        steps run one after the other, each depending on the one before it.
+        """
+        text = response_text.strip()
+        # Drop a Markdown code fence around the JSON, if any.
+        fence = re.match(r"^```(?:json)?\s*(.*?)\s*```$", text, re.DOTALL)
+        if fence:
+            text = fence.group(1)
+        try:
+            items = json.loads(text)
+            if isinstance(items, dict):
+                items = items["steps"]
+            steps = [
+                {
+                    "id": int(item["id"]),
+                    "step": str(item["step"]).strip(),
+                    "depends_on": [int(dependency) for dependency in item.get("depends_on") or []]
+                }
+                for item in items
+            ]
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return cls._step_chain(cls._parse_steps(response_text))
+
+        # Forward, unknown and self dependencies are dropped, as are cycles with them.
+        earlier = set()
+        for step in steps:
+            step["depends_on"] = [dependency for dependency in dict.fromkeys(step["depends_on"])
+                                  if dependency in earlier]
+            earlier.add(step["id"])
+        if len(earlier) != len(steps):
+            return cls._step_chain([step["step"] for step in steps])
         return steps
+
+    @staticmethod
+    def _step_chain(steps):
+        """A step graph that runs the steps one after the other."""
+        return [{"id": i + 1, "step": step, "depends_on": [i] if i else []} for i, step in enumerate(steps)]
+
+    def extract_step_graph_from_prompt(self, prompt):
+        """
+        Uses an LLM to extract the action steps of a user prompt together with
+        their dependencies, so that independent steps can run in parallel.
+        Returns a list of {'id', 'step', 'depends_on'} dicts.
+        """
+        response = self.client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._graph_messages(prompt)
+        )
+        return self._parse_step_graph(response.choices[0].message.content)
+
+    async def extract_step_graph_async(self, prompt):
+        """
+        Coroutine version of extract_step_graph_from_prompt() using the shared async client.
+        """
+        response = await self.async_client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=self._graph_messages(prompt)
+        )
+        return self._parse_step_graph(response.choices[0].message.content)
@@ -0,0 +1,220 @@
+"""
+Runs the agentic workflow for many product specifications.
+
+Specs are read from directories of .txt / .md files, single files or JSONL
+files of {"id": ..., "text": ...} lines; a JSONL line may also give its own
+"prompt" and "product" name instead of the global ones. Jobs run on a bounded pool of worker
+threads that share one client, so the scheduler's rate limits and the caches
+apply to the whole batch. Every finished job is appended to the output file as
+one JSON line as soon as it is done; re-running the same command skips the
+specs that already succeeded and retries the failed ones.
+
+Run from the phase_2 directory:
+
+    python batch_workflow.py specs/ --output results.jsonl --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Spec ingestion and the metrics live in the phase_1 workflow_agents package.
+PHASE_1_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "phase_1")
+if PHASE_1_DIR not in sys.path:
+    sys.path.append(PHASE_1_DIR)
+
+from agentic_workflow import (
+    DEFAULT_PRODUCT_NAME,
+    MAX_PARALLEL_STEPS,
+    WORKFLOW_PROMPT,
+    build_agents,
+    create_clients,
+    run_workflow,
+)
+from workflow_agents.ingestion import iter_documents
+from workflow_agents.metrics import RoutingMetrics
+
+
+def product_name(spec_id):
+    """
+    Product name for a spec, taken from its id: "specs/Product-Spec-Email-Router.txt"
+    becomes "Email Router".
+    """
+    name = os.path.splitext(os.path.basename(str(spec_id)))[0]
+    if name.startswith("Product-Spec-"):
+        name = name[len("Product-Spec-"):]
+    name = name.replace("-", " ").replace("_", " ").strip()
+    return name or DEFAULT_PRODUCT_NAME
+
+
+def iter_specs(*sources):
+    """
+    Lazily yields (spec_id, text, options) jobs. Sources are read like
+    workflow_agents.ingestion.iter_documents, except that the options of a
+    JSONL line hold its "prompt" and "product", if given. A line without an id
+    gets "<path>:<line number>" and, without a product, the file's product name
+    followed by the line number, so every job has an id and an output of its own.
+    """
+    for source in sources:
+        path = os.fspath(source)
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith((".txt", ".md", ".jsonl")):
+                        yield from iter_specs(os.path.join(root, name))
+        elif path.endswith(".jsonl"):
+            with open(path, encoding="utf-8") as f:
+                for line_number, line in enumerate(f):
+                    if line.strip():
+                        record = json.loads(line)
+                        options = {key: record[key] for key in ("prompt", "product") if record.get(key)}
+                        if "id" not in record and "product" not in options:
+                            options["product"] = f"{product_name(path)} {line_number + 1}"
+                        yield record.get("id", f"{path}:{line_number}"), record["text"], options
+        else:
+            for spec_id, text in iter_documents(path):
+                yield spec_id, text, {}
+
+
+def completed_ids(path):
+    """Ids of the jobs recorded as successful in an existing results file."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run.
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+class BatchRunner:
+    """
+    Runs one workflow per spec on a pool of worker threads and appends each
+    result to a JSONL file. At most workers jobs run and queue_size more wait
+    at any time, so specs are read lazily however many there are.
+    """
+    def __init__(self, output, base_url, api_key, workers=4, queue_size=None, workflow_prompt=WORKFLOW_PROMPT,
+                 max_parallel_steps=MAX_PARALLEL_STEPS):
+        self.output = output
+        self.base_url = base_url
+        self.api_key = api_key
+        self.workers = workers
+        self.queue_size = workers if queue_size is None else queue_size
+        self.workflow_prompt = workflow_prompt
+        self.max_parallel_steps = max_parallel_steps
+        self.client, self.scheduler, self.response_cache, self.embedding_cache = create_clients(base_url, api_key)
+        # The routing decisions of all jobs.
+        self.metrics = RoutingMetrics()
+        self.counts = {"ok": 0, "error": 0, "skipped": 0}
+        self._lock = threading.Lock()
+
+    def run_job(self, spec_id, product_spec, prompt=None, product=None):
+        """
+        Runs the workflow for one spec and returns its result record. prompt and
+        product default to the runner's workflow prompt and the name taken from spec_id.
+        """
+        product = product or product_name(spec_id)
+        record = {"id": spec_id, "product": product}
+        start = time.perf_counter()
+        try:
+            action_planning_agent, routing_agent = build_agents(
+                product_spec, self.base_url, self.api_key, self.client,
+                product_name=product, embedding_cache=self.embedding_cache, metrics=self.metrics
+            )
+            workflow = run_workflow(action_planning_agent, routing_agent,
+                                    (prompt or self.workflow_prompt).format(product=product),
+                                    max_parallel_steps=self.max_parallel_steps, verbose=False)
+            record["status"] = "ok"
+            record["steps"] = [
+                {**step, "result": result} for step, result in zip(workflow["steps"], workflow["results"])
+            ]
+            record["final_output"] = workflow["final_output"]
+        except Exception as error:
+            record["status"] = "error"
+            record["error"] = f"{type(error).__name__}: {error}"
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        return record
+
+    def _write(self, f, record):
+        with self._lock:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            self.counts[record["status"]] += 1
+            print(f"[{self.counts['ok'] + self.counts['error']}] {record['id']}: {record['status']} "
+                  f"in {record['seconds']:.1f} s" + (f" ({record['error']})" if "error" in record else ""))
+
+    def run(self, specs):
+        """
+        Runs every (spec_id, text) pair or (spec_id, text, options) job, as from
+        iter_specs(), whose id has not already succeeded in the output file.
+        Returns the number of jobs that succeeded, failed and were skipped.
+        """
+        done = completed_ids(self.output)
+        slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+
+        def job(spec_id, product_spec, options, f):
+            try:
+                self._write(f, self.run_job(spec_id, product_spec, **options))
+            finally:
+                slots.release()
+
+        with open(self.output, "a") as f, ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for spec_id, product_spec, *options in specs:
+                if spec_id in done:
+                    self.counts["skipped"] += 1
+                    continue
+                # Wait for a free slot before reading on, so the queue stays bounded.
+                slots.acquire()
+                pool.submit(job, spec_id, product_spec, options[0] if options else {}, f)
+        return dict(self.counts)
+
+    def close(self):
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="spec directories, files or JSONL files")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--workers", type=int, default=4, help="workflows run at the same time")
+    parser.add_argument("--queue-size", type=int, help="specs read ahead of the workers (default: --workers)")
+    parser.add_argument("--prompt", default=WORKFLOW_PROMPT,
+                        help="workflow prompt, unless a JSONL spec gives its own; "
+                             "{product} is replaced with the product name")
+    parser.add_argument("--max-parallel-steps", type=int, default=MAX_PARALLEL_STEPS,
+                        help="steps of one workflow run at the same time")
+    args = parser.parse_args()
+
+    base_url = os.getenv("OPENAI_BASE_URL", "https://openai.vocareum.com/v1")
+    api_key = "voc-00000000000000000000000000000000abcd.12345678"
+
+    runner = BatchRunner(args.output, base_url, api_key, workers=args.workers, queue_size=args.queue_size,
+                         workflow_prompt=args.prompt, max_parallel_steps=args.max_parallel_steps)
+    start = time.perf_counter()
+    try:
+        counts = runner.run(iter_specs(*args.sources))
+    finally:
+        runner.close()
+    print(f"\n{counts['ok']} succeeded, {counts['error']} failed, {counts['skipped']} skipped "
+          f"in {time.perf_counter() - start:.1f} s")
+    print(f"Scheduler: {runner.scheduler.stats()}")
+    routing = runner.metrics.snapshot()
+    print(f"Routing: {routing['decisions']} decisions, {routing['teams']} by {routing['sources']}")
+    if runner.response_cache is not None:
+        print(f"Response cache: {runner.response_cache.stats()}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
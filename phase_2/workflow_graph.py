@@ -0,0 +1,80 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def check_step_graph(steps):
+    """
+    Validates a step graph from ActionPlanningAgent.extract_step_graph_from_prompt:
+    ids must be unique, dependencies must name existing steps, and there must be
+    no cycles. Raises ValueError otherwise.
+    """
+    by_id = {}
+    for step in steps:
+        if step["id"] in by_id:
+            raise ValueError(f"Duplicate step id {step['id']}.")
+        by_id[step["id"]] = step
+    for step in steps:
+        for dependency in step["depends_on"]:
+            if dependency not in by_id:
+                raise ValueError(f"Step {step['id']} depends on unknown step {dependency}.")
+
+    # Kahn's algorithm: if some steps never become ready, they form a cycle.
+    remaining = {step["id"]: len(step["depends_on"]) for step in steps}
+    dependents = {step["id"]: [] for step in steps}
+    for step in steps:
+        for dependency in step["depends_on"]:
+            dependents[dependency].append(step["id"])
+    ready = [step_id for step_id, count in remaining.items() if count == 0]
+    visited = 0
+    while ready:
+        step_id = ready.pop()
+        visited += 1
+        for dependent in dependents[step_id]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+    if visited != len(steps):
+        raise ValueError("The step dependencies contain a cycle.")
+
+
+def run_step_graph(steps, run_step, max_workers=4):
+    """
+    Runs the steps of a workflow as a dependency graph on a pool of at most
+    max_workers threads. Each step starts as soon as all of the steps it depends
+    on have finished, so independent steps run concurrently.
+
+    run_step(step, dependency_results) is called for every step, where
+    dependency_results maps the ids in step['depends_on'] to their results.
+    Returns a dict mapping every step id to its result. If a step raises, no
+    further steps are started and the exception is re-raised once the steps
+    already running have finished.
+    """
+    check_step_graph(steps)
+    results = {}
+    pending = {step["id"]: step for step in steps}
+    running = {}
+
+    def start_ready_steps(pool):
+        for step_id, step in list(pending.items()):
+            if all(dependency in results for dependency in step["depends_on"]):
+                dependency_results = {dependency: results[dependency] for dependency in step["depends_on"]}
+                # Run each step in a copy of the caller's context so context
+                # variables (e.g. the current tracing span) carry over.
+                context = contextvars.copy_context()
+                running[pool.submit(context.run, run_step, step, dependency_results)] = step_id
+                del pending[step_id]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        start_ready_steps(pool)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step_id = running.pop(future)
+                error = future.exception()
+                if error is not None:
+                    # Let the steps already in flight finish, then fail.
+                    wait(running)
+                    raise error
+                results[step_id] = future.result()
+            start_ready_steps(pool)
+    return results